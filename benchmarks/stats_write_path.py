@@ -0,0 +1,193 @@
+"""Measures how many events per second the Stats listeners sustain, against an in-memory database.
+
+python -m benchmarks.stats_write_path [--events N] [--latency SECONDS] [--guilds N] [--channels N] [--users N]
+"""
+
+import asyncio
+import random
+from argparse import ArgumentParser
+from collections import Counter
+from statistics import quantiles
+from time import perf_counter
+from types import SimpleNamespace
+
+from pymongo import UpdateOne
+
+from cogs.stats import Stats, STATS_MAX_BUFFER_SIZE
+
+WORDS = ('pog', 'kekw', 'hello', 'gg', 'nice', 'lol', 'what', 'ok')
+
+
+class MemoryCollection:
+    """The part of a Motor collection used by the stats write path, with a fixed latency per call."""
+
+    def __init__(self, name: str, database: 'MemoryDatabase'):
+        self.name = name
+        self.database = database
+        self.documents: dict[tuple, dict] = {}
+
+    async def _call(self, operations: int = 1):
+        self.database.calls += 1
+        self.database.operations += operations
+        await asyncio.sleep(self.database.latency)
+
+    def _upsert(self, query: dict, update: dict):
+        key = tuple(sorted((field, value) for field, value in query.items() if not isinstance(value, dict)))
+        document = self.documents.get(key)
+        if document is None:
+            document = self.documents[key] = {**dict(key), **update.get('$setOnInsert', {})}
+
+        for field, value in update.get('$inc', {}).items():
+            document[field] = document.get(field, 0) + value
+
+    async def bulk_write(self, operations: list[UpdateOne], ordered: bool = True):
+        await self._call(len(operations))
+        for operation in operations:
+            self._upsert(operation._filter, operation._doc)
+
+    async def update_many(self, query: dict, update: dict, upsert: bool = False):
+        await self._call()
+
+
+class MemoryDatabase:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self.operations = 0
+        self.collections: dict[str, MemoryCollection] = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(name, self)
+
+        return self.collections[name]
+
+
+class EventFactory:
+    """Builds message and reaction payloads with the attributes the listeners read."""
+
+    def __init__(self, guilds: int, channels: int, users: int):
+        self.guilds = [SimpleNamespace(id=guild_id) for guild_id in range(1, guilds + 1)]
+        self.channels = [
+            (guild, SimpleNamespace(id=guild.id * 1000 + channel_id))
+            for guild in self.guilds
+            for channel_id in range(channels)
+        ]
+        self.users = [SimpleNamespace(id=user_id) for user_id in range(1, users + 1)]
+        self.sent: list[tuple[int, int, int]] = []
+        self.next_id = 1
+
+    def message(self) -> SimpleNamespace:
+        guild, channel = random.choice(self.channels)
+        message = SimpleNamespace(
+            id=self.next_id,
+            guild=guild,
+            channel=channel,
+            author=random.choice(self.users),
+            content=' '.join(random.choices(WORDS, k=random.randint(1, 20))),
+            attachments=[None] * (random.random() < 0.05)
+        )
+
+        self.next_id += 1
+        self.sent.append((message.id, guild.id, channel.id))
+        return message
+
+    def reaction(self) -> SimpleNamespace:
+        message_id, guild_id, channel_id = random.choice(self.sent)
+        return SimpleNamespace(
+            message_id=message_id,
+            guild_id=guild_id,
+            channel_id=channel_id,
+            user_id=random.choice(self.users).id
+        )
+
+    def edit(self) -> SimpleNamespace:
+        message_id, guild_id, channel_id = random.choice(self.sent)
+        return SimpleNamespace(
+            message_id=message_id,
+            guild_id=guild_id,
+            channel_id=channel_id,
+            cached_message=None,
+            data={'content': ' '.join(random.choices(WORDS, k=random.randint(1, 20)))}
+        )
+
+    def delete(self) -> SimpleNamespace:
+        message_id, guild_id, channel_id = self.sent.pop(random.randrange(len(self.sent)))
+        return SimpleNamespace(
+            message_id=message_id,
+            guild_id=guild_id,
+            channel_id=channel_id,
+            cached_message=None
+        )
+
+
+async def run(events: int, latency: float, guilds: int, channels: int, users: int, seed: int):
+    random.seed(seed)
+
+    database = MemoryDatabase(latency)
+    cog = Stats(SimpleNamespace(db=database))
+
+    # Only the flush loop is part of the write path
+    cog.weekly_stats.cancel()
+    cog.compact_stats.cancel()
+    cog.attribute_reactions.cancel()
+
+    factory = EventFactory(guilds, channels, users)
+    handlers = {
+        'message': (cog.save_message, factory.message),
+        'reaction_add': (cog.save_reaction, factory.reaction),
+        'reaction_remove': (cog.save_reaction_remove, factory.reaction),
+        'edit': (cog.save_message_edit, factory.edit),
+        'delete': (cog.save_message_remove, factory.delete)
+    }
+    weights = {'message': 60, 'reaction_add': 25, 'reaction_remove': 5, 'edit': 7, 'delete': 3}
+
+    latencies: dict[str, list[float]] = {name: [] for name in handlers}
+    counts = Counter()
+
+    started_at = perf_counter()
+    for _ in range(events):
+        name = random.choices(list(weights), list(weights.values()))[0] if factory.sent else 'message'
+        handler, build = handlers[name]
+        event = build()
+
+        handler_started_at = perf_counter()
+        await handler(event)
+        latencies[name].append(perf_counter() - handler_started_at)
+        counts[name] += 1
+
+    await cog.cog_unload()
+    elapsed = perf_counter() - started_at
+
+    print(f'{events:,} events in {elapsed:.2f}s: {events / elapsed:,.0f} events/s')
+    print(f'Database latency: {latency * 1000:.1f}ms, buffer size: {STATS_MAX_BUFFER_SIZE:,}')
+    print(f'Database calls: {database.calls:,} ({database.calls / events:.4f}/event)')
+    print(f'Write operations: {database.operations:,} ({database.operations / events:.4f}/event)')
+    print()
+    print(f'{"handler":<16}{"events":>10}{"p50 (us)":>12}{"p99 (us)":>12}{"max (ms)":>12}')
+    for name, values in latencies.items():
+        if len(values) < 2:
+            continue
+
+        percentiles = quantiles(values, n=100)
+        print(
+            f'{name:<16}{counts[name]:>10,}{percentiles[49] * 1e6:>12.1f}{percentiles[98] * 1e6:>12.1f}'
+            f'{max(values) * 1000:>12.2f}'
+        )
+
+
+def main():
+    parser = ArgumentParser(description='Benchmarks the stats write path.')
+    parser.add_argument('--events', type=int, default=100_000)
+    parser.add_argument('--latency', type=float, default=0.002, help='The latency of a database call, in seconds')
+    parser.add_argument('--guilds', type=int, default=5)
+    parser.add_argument('--channels', type=int, default=20, help='The amount of channels per guild')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.events, args.latency, args.guilds, args.channels, args.users, args.seed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,79 +1,208 @@
-from io import BytesIO
+from asyncio import get_running_loop, to_thread
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from io import BufferedReader, BytesIO
+from logging import getLogger
+from os import getenv, path
 from random import randrange
-from typing import TYPE_CHECKING
+from tempfile import gettempdir
+from typing import TYPE_CHECKING, NamedTuple
 
-from discord import app_commands, Interaction, File, Message, Forbidden, HTTPException
+from discord import app_commands, Emoji, Guild, Interaction, File, Message, Forbidden, HTTPException
 from discord.app_commands import command
 from discord.ext.commands import Cog
+from motor.core import AgnosticCollection
+from pymongo import IndexModel, ASCENDING
+from pymongo.errors import PyMongoError
 
+from utils.cache import AsyncTTLCache
 from utils.embeds import error_embed, success_embed
+from utils.emote_image import fit_emote
+from utils.emote_pool import EmotePool
+from utils.image_cache import ImageCache
+from utils.indexes import QueryShape, ensure_indexes
 from utils.views import YesNoView, QueryModal
 
 if TYPE_CHECKING:
     from nextbot import NextBot
 
+log = getLogger(__name__)
+
 BASE_URL = 'https://api.frankerfacez.com/v1/'
 
+SEARCH_CACHE_SIZE = 2000
+SEARCH_CACHE_BYTES = 4 * 1024 * 1024
+SEARCH_CACHE_TTL = 30 * 60
+
+FFZ_IMAGE_CACHE_DIR = getenv('FFZ_IMAGE_CACHE_DIR', path.join(gettempdir(), 'nextbot-ffz-images'))
+FFZ_IMAGE_CACHE_BYTES = int(getenv('FFZ_IMAGE_CACHE_MB', 256)) * 1024 * 1024
+FFZ_IMAGE_WORKERS = int(getenv('FFZ_IMAGE_WORKERS', 2))
+FFZ_REACTION_SLOTS = int(getenv('FFZ_REACTION_SLOTS', 5))
+
+
+class SearchPage(NamedTuple):
+    """A page of emoticons search results, only with what is needed from them."""
+
+    pages: int
+    # The name and the image url of each emote
+    emotes: list[tuple[str, str]]
+
+    def sizeof(self) -> int:
+        """Estimates the memory taken by the page."""
+
+        return 64 + sum(100 + len(name) + len(url) for name, url in self.emotes)
+
 
 class FFZ(Cog):
     bot: 'NextBot'
+    reaction_slots: AgnosticCollection
+
+    indexes = {'ffz_reaction_slots': [IndexModel([('guild_id', ASCENDING), ('emoji_id', ASCENDING)], unique=True)]}
+    query_shapes = (QueryShape('ffz_reaction_slots', {'guild_id': 0}),)
 
     def __init__(self, bot: 'NextBot'):
         self.bot = bot
+        # The emojis created for the reaction slots, so only those are reused and replaced after a restart
+        self.reaction_slots = self.bot.db['ffz_reaction_slots']
+        self.search_cache = AsyncTTLCache(
+            SEARCH_CACHE_SIZE,
+            SEARCH_CACHE_TTL,
+            max_bytes=SEARCH_CACHE_BYTES,
+            sizeof=SearchPage.sizeof
+        )
+        self.image_cache = ImageCache(FFZ_IMAGE_CACHE_DIR, FFZ_IMAGE_CACHE_BYTES)
+        # The workers are only started once an image needs to be processed. They are started from a fork server,
+        # forking the bot itself could copy a lock held by one of its threads into them
+        self.image_pool = ProcessPoolExecutor(FFZ_IMAGE_WORKERS, mp_context=get_context('forkserver'))
+        # The amount of static emojis of each guild, recounted when the guild's emojis change
+        self.static_emojis: dict[int, int] = {}
+        self.reaction_pool = EmotePool(FFZ_REACTION_SLOTS)
 
         react_context_menu = app_commands.ContextMenu(name='React with FFZ emote', callback=self.react)
         self.bot.tree.add_command(react_context_menu)
 
+    async def cog_load(self):
+        await ensure_indexes(self.bot.db, self.indexes)
+        await to_thread(self.image_cache.load)
+
+    async def cog_unload(self):
+        self.image_pool.shutdown(wait=False, cancel_futures=True)
+
+    @Cog.listener('on_guild_emojis_update')
+    async def on_guild_emojis_update(self, guild: Guild, before: list[Emoji], after: list[Emoji]):
+        self.static_emojis.pop(guild.id, None)
+        self.reaction_pool.discard_emojis(guild.id, {emoji.id for emoji in after})
+
+    def has_emoji_slot(self, guild: Guild) -> bool:
+        """Checks if the guild has space for another static emoji."""
+
+        count = self.static_emojis.get(guild.id)
+        if count is None:
+            count = self.static_emojis[guild.id] = sum(not emoji.animated for emoji in guild.emojis)
+
+        return count < guild.emoji_limit
+
+    def emoji_created(self, guild: Guild):
+        if guild.id in self.static_emojis:
+            self.static_emojis[guild.id] += 1
+
+    async def fit_emote(self, image: bytes) -> bytes | None:
+        """Makes the image fit in the emoji size limit in the process pool.
+
+        Returns None if it can't, because the image is too big or isn't a valid image.
+        """
+
+        try:
+            return await get_running_loop().run_in_executor(self.image_pool, fit_emote, image)
+        except (ValueError, OSError) as e:
+            log.warning(f'Failed to fit an emote in the emoji size limit: {e}')
+            return None
+
     async def fetch_ffz(self, endpoint: str, params: dict[str, str]) -> dict:
         """Fetches an endpoint from the FFZ API."""
 
         async with self.bot.session.get(BASE_URL + endpoint, params=params) as response:
             return await response.json()
 
-    async def fetch_image(self, url: str, data_type: str) -> bytes | BytesIO:
-        """Fetches a url."""
+    async def fetch_image(self, url: str, data_type: str) -> bytes | BufferedReader | BytesIO:
+        """Fetches an image, from the image cache if it has already been downloaded.
+
+        Cached images are returned as the open cache file for the 'file' data type, so they are sent without being
+        read into memory. discord.File doesn't close the files it is given, so the caller has to.
+        """
+
+        if data_type == 'file':
+            file = await to_thread(self.image_cache.open, url)
+            if file is not None:
+                return file
+        else:
+            image = await to_thread(self.image_cache.read, url)
+            if image is not None:
+                return image
 
         async with self.bot.session.get(url) as response:
-            if data_type == 'file':
-                return BytesIO(await response.read())
+            image = await response.read()
 
-            if data_type == 'img':
-                return await response.read()
+        if response.status == 200:
+            await to_thread(self.image_cache.put, url, image)
 
-    async def get_image(self, query: str, option: str | int, file_type: str) -> dict | None:
-        """Gets an image from FFZ API."""
+        if data_type == 'file':
+            return BytesIO(image)
+
+        if data_type == 'img':
+            return image
 
-        params = {'q': query}
+    async def search(self, query: str, sort: str | None, page: int) -> SearchPage:
+        """Searches the emoticons, the pages are cached by (query, sort, page) and concurrent searches are shared."""
 
-        if isinstance(option, int):
-            params['sort'] = 'count-desc'
+        async def fetch_page() -> SearchPage:
+            params = {'q': query, 'page': str(page)}
+            if sort is not None:
+                params['sort'] = sort
 
-        data = await self.fetch_ffz('emoticons', params)
-        if not data['emoticons']:
+            data = await self.fetch_ffz('emoticons', params)
+            return SearchPage(
+                data['_pages'],
+                [(emote['name'], emote['urls'].get('2') or emote['urls']['1']) for emote in data['emoticons']]
+            )
+
+        return await self.search_cache.get((query, sort, page), fetch_page)
+
+    async def pick_emote(self, query: str, option: str | int) -> tuple[str, str] | None:
+        """Picks an emote from the search results, returns its name and image url."""
+
+        sort = 'count-desc' if isinstance(option, int) else None
+
+        results = await self.search(query, sort, 1)
+        if not results.emotes:
             return None
 
         if option == 'random':
-            pages = data['_pages']
-            if pages > 1:
-                page = randrange(1, pages)
-                params['page'] = str(page)
-                data = await self.fetch_ffz('emoticons', params)  # fetches the randomized page
+            if results.pages > 1:
+                # The page count is remembered with the first page, so only the randomized page may need a request
+                results = await self.search(query, sort, randrange(1, results.pages))
+                if not results.emotes:
+                    return None
 
-            index = randrange(0, len(data['emoticons']))
+            index = randrange(0, len(results.emotes))
         else:
             index = option - 1
-            if index >= len(data['emoticons']):
+            if index >= len(results.emotes):
                 return None
 
-        # Gets the image_url from json data
-        try:
-            img_url = data['emoticons'][index]['urls']['2']
-        except KeyError:
-            img_url = data['emoticons'][index]['urls']['1']
+        return results.emotes[index]
+
+    async def get_image(self, query: str, option: str | int, file_type: str) -> dict | None:
+        """Gets an image from FFZ API."""
+
+        emote = await self.pick_emote(query, option)
+        if emote is None:
+            return None
+
+        file_name, img_url = emote
 
         # Fetches image data
         image = await self.fetch_image(img_url, file_type)
-        file_name = data['emoticons'][index]['name']
 
         return {'file': image, 'name': file_name}
 
@@ -98,9 +227,9 @@ class FFZ(Cog):
         if data is None:
             return await error_embed(interaction, 'No results!')
 
-        image = data['file']
         name = data['name']
-        await interaction.response.send_message(file=File(image, f'{name}.png'))
+        with data['file'] as image:
+            await interaction.response.send_message(file=File(image, f'{name}.png'))
 
     @command()
     @app_commands.describe(
@@ -119,15 +248,14 @@ class FFZ(Cog):
 
         option = number or 'random' if random else 1
 
-        data = await self.get_image(query, option, 'file')
+        # The bytes are kept for the upload, so the image isn't downloaded again from the message
+        data = await self.get_image(query, option, 'img')
         if data is None:
             return await error_embed(interaction, 'No results!')
 
         image = data['file']
         name = data['name']
-        await interaction.response.send_message(file=File(image, f'{name}.png'))
-
-        emote_message = await interaction.original_response()
+        await interaction.response.send_message(file=File(BytesIO(image), f'{name}.png'))
 
         view = YesNoView(interaction.user.id)
         confirmation_message = await interaction.channel.send('**Upload the emote?**', view=view)
@@ -145,14 +273,88 @@ class FFZ(Cog):
         if not view.value:
             return
 
-        if not len([e for e in interaction.guild.emojis if not e.animated]) < interaction.guild.emoji_limit:
-            return await error_embed(interaction, 'There is no space to upload the emote!')
+        image = await self.fit_emote(image)
+        if image is None:
+            return await error_embed(interaction, 'The emote is too big or isn\'t a valid image!')
+
+        guild = interaction.guild
+        # Under the reaction slots' lock, so a reaction can't take the space before the emote is created
+        async with self.reaction_pool.lock(guild.id):
+            try:
+                if not self.has_emoji_slot(guild):
+                    # Makes space by replacing the least recently used reaction emote
+                    if guild.id not in self.reaction_pool:
+                        await self.load_reaction_slots(guild)
+
+                    if not await self.free_reaction_slot(guild):
+                        return await error_embed(interaction, 'There is no space to upload the emote!')
+
+                emote = await guild.create_custom_emoji(name=name, image=image)
+            except Forbidden:
+                return await error_embed(interaction, 'I don\'t have permissions to create an emote!')
+            except HTTPException:
+                return await error_embed(interaction, 'Uploading the emote failed!')
 
-        image = await emote_message.attachments[0].read()
-        emote = await interaction.guild.create_custom_emoji(name=name, image=image)
+            self.emoji_created(guild)
 
         await success_embed(interaction, f'Successfully uploaded the emote: {emote}')
 
+    async def free_reaction_slot(self, guild: Guild) -> bool:
+        """Makes space for a reaction emote, replacing the least recently used slot if there is no free one.
+
+        Returns False if there is no space and no slot to replace.
+        """
+
+        if not self.reaction_pool.is_full(guild.id) and self.has_emoji_slot(guild):
+            return True
+
+        slot = self.reaction_pool.least_recently_used(guild.id)
+        if slot is None:
+            return False
+
+        key, emoji_id = slot
+        emoji = guild.get_emoji(emoji_id)
+        if emoji is not None:
+            await emoji.delete()
+            if guild.id in self.static_emojis:
+                self.static_emojis[guild.id] -= 1
+
+        self.reaction_pool.remove(guild.id, key)
+        await self.forget_reaction_slot(guild, emoji_id)
+        return True
+
+    async def load_reaction_slots(self, guild: Guild):
+        """Adopts the guild's reaction slots stored before a restart, whose emojis still exist."""
+
+        try:
+            stored = await self.reaction_slots.find({'guild_id': guild.id}).to_list(length=None)
+        except PyMongoError as e:
+            log.error(f'Failed to load the reaction slots of {guild}: {e}')
+            stored = []
+
+        emoji_ids = {emoji.id for emoji in guild.emojis}
+        self.reaction_pool.adopt(
+            guild.id,
+            [(slot['key'], slot['emoji_id']) for slot in stored if slot['emoji_id'] in emoji_ids]
+        )
+
+        # The emojis that were deleted meanwhile
+        for slot in stored:
+            if slot['emoji_id'] not in emoji_ids:
+                await self.forget_reaction_slot(guild, slot['emoji_id'])
+
+    async def store_reaction_slot(self, guild: Guild, key: str, emoji_id: int):
+        try:
+            await self.reaction_slots.insert_one({'guild_id': guild.id, 'emoji_id': emoji_id, 'key': key})
+        except PyMongoError as e:
+            log.error(f'Failed to store a reaction slot of {guild}, it won\'t be reused after a restart: {e}')
+
+    async def forget_reaction_slot(self, guild: Guild, emoji_id: int):
+        try:
+            await self.reaction_slots.delete_one({'guild_id': guild.id, 'emoji_id': emoji_id})
+        except PyMongoError as e:
+            log.error(f'Failed to remove a reaction slot of {guild}: {e}')
+
     async def react(self, interaction: Interaction, message: Message):
         """Reacts to the message with an emote from FFZ."""
 
@@ -168,29 +370,60 @@ class FFZ(Cog):
                 ephemeral=True
             )
 
-        data = await self.get_image(modal.query.value, 1, 'img')
-        if data is None:
+        emote = await self.pick_emote(modal.query.value, 1)
+        if emote is None:
             return await error_embed(interaction, 'No results!', ephemeral=True)
 
-        image = data['file']
-        name = data['name']
-        try:
-            emote = await interaction.guild.create_custom_emoji(name=name, image=image)
-        except Forbidden:
-            return await error_embed(interaction, 'I don\'t have permissions to create an emote!', ephemeral=True)
-        except HTTPException:
-            return await error_embed(interaction, 'Adding an emote failed!', ephemeral=True)
-
-        try:
-            await message.add_reaction(emote)
-        except Forbidden:
-            return await error_embed(
-                interaction,
-                'I don\'t have permissions to add the emote to the message!',
-                ephemeral=True
-            )
+        name, url = emote
+        guild = interaction.guild
+        async with self.reaction_pool.lock(guild.id):
+            if guild.id not in self.reaction_pool:
+                await self.load_reaction_slots(guild)
+
+            # Emotes that are still in a slot are reacted with right away
+            emoji_id = self.reaction_pool.get(guild.id, url)
+            emoji = guild.get_emoji(emoji_id) if emoji_id is not None else None
+
+            if emoji is None:
+                if emoji_id is not None:
+                    # The slot's emoji was deleted, so the stored slot is stale
+                    self.reaction_pool.remove(guild.id, url)
+                    await self.forget_reaction_slot(guild, emoji_id)
+
+                image = await self.fit_emote(await self.fetch_image(url, 'img'))
+                if image is None:
+                    return await error_embed(
+                        interaction,
+                        'The emote is too big or isn\'t a valid image!',
+                        ephemeral=True
+                    )
+
+                try:
+                    if not await self.free_reaction_slot(guild):
+                        return await error_embed(interaction, 'There is no space to add the emote!', ephemeral=True)
+
+                    emoji = await guild.create_custom_emoji(name=name, image=image)
+                except Forbidden:
+                    return await error_embed(
+                        interaction,
+                        'I don\'t have permissions to create an emote!',
+                        ephemeral=True
+                    )
+                except HTTPException:
+                    return await error_embed(interaction, 'Adding an emote failed!', ephemeral=True)
+
+                self.reaction_pool.add(guild.id, url, emoji.id)
+                self.emoji_created(guild)
+                await self.store_reaction_slot(guild, url, emoji.id)
 
-        await emote.delete()
+            try:
+                await message.add_reaction(emoji)
+            except Forbidden:
+                return await error_embed(
+                    interaction,
+                    'I don\'t have permissions to add the emote to the message!',
+                    ephemeral=True
+                )
 
 
 async def setup(bot: 'NextBot'):
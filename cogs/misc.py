@@ -13,6 +13,7 @@ from discord.ext.commands import Context, Cog, command as normal_command
 
 from utils.checks import is_next
 from utils.embeds import *
+from utils.indexes import explain_query
 
 if TYPE_CHECKING:
     from nextbot import NextBot
@@ -220,6 +221,35 @@ class Misc(Cog):
 
         await self.bot.reload_extension(f'cogs.{name}')
 
+    @normal_command()
+    @is_next()
+    async def explain(self, ctx: Context):
+        """Explains the hot queries of the cogs and shows whether they are covered by an index or scanning."""
+
+        lines = []
+        for cog in self.bot.cogs.values():
+            for shape in getattr(cog, 'query_shapes', ()):
+                plan = await explain_query(self.bot.db[shape.collection], shape)
+
+                if plan.scanning:
+                    status = '❌ Scanning'
+                elif plan.covered:
+                    status = '✅ Covered'
+                else:
+                    status = '✅ Indexed'
+
+                query = ', '.join(shape.filter)
+                if shape.sort is not None:
+                    query += f' | sort: {", ".join(key for key, _ in shape.sort)}'
+
+                lines.append(
+                    f'{status} **{shape.collection}** `{query}`\n'
+                    f'{" > ".join(reversed(plan.stages))} - '
+                    f'{plan.docs_examined:,} docs / {plan.keys_examined:,} keys examined, {plan.returned:,} returned'
+                )
+
+        await green_embed(ctx, '\n\n'.join(lines) or 'No queries to explain!')
+
     @Cog.listener('on_raw_member_remove')
     async def log_member_who_leave(self, payload: discord.RawMemberRemoveEvent):
         """Logs members who leave the server."""
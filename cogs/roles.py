@@ -6,9 +6,11 @@ from discord import app_commands, Interaction, Message, Emoji, Color
 from discord.app_commands import command, Range
 from discord.ext.commands import GroupCog
 from motor.core import AgnosticCollection
+from pymongo import IndexModel
 
 from utils.embeds import error_embed, success_embed, green_embed, Embed
 from utils.errors import interactions_error_handler
+from utils.indexes import QueryShape, ensure_indexes
 from utils.transformers import EmoteTransform, ColorTransform, EmoteOrDescriptionTransform, InvalidEmote, InvalidColor
 from utils.views import YesNoView, RolesView
 
@@ -20,13 +22,17 @@ class Roles(GroupCog, name='roles'):
     bot: 'NextBot'
     roles: AgnosticCollection
 
+    indexes = {'roles': [IndexModel('guild_id')]}
+    query_shapes = (QueryShape('roles', {'guild_id': 0}),)
+
     def __init__(self, bot: 'NextBot'):
         self.bot = bot
         self.roles = self.bot.db['roles']
 
     async def cog_load(self):
-        """Adds the Roles view."""
+        """Creates the indexes and adds the Roles view."""
 
+        await ensure_indexes(self.bot.db, self.indexes)
         self.bot.add_view(RolesView(self.bot))
 
     async def cog_app_command_error(self, interaction: Interaction, error: app_commands.AppCommandError):
@@ -1,7 +1,13 @@
-from collections import defaultdict
-from datetime import time
+from asyncio import gather, ensure_future, wait, sleep, Semaphore, to_thread
+from collections import Counter, defaultdict
+from datetime import time, datetime, timedelta
 from logging import getLogger
-from typing import TYPE_CHECKING, TypedDict, Literal
+from os import getenv
+from os.path import join
+from shutil import copyfileobj
+from tempfile import TemporaryFile
+from time import perf_counter
+from typing import TYPE_CHECKING, Literal, Mapping, AsyncIterator
 
 import discord
 from discord import app_commands, Interaction
@@ -9,10 +15,19 @@ from discord.ext import commands
 from discord.ext.commands import GroupCog, Context
 from discord.ext.tasks import loop
 from motor.core import AgnosticCollection
+from pymongo import UpdateOne, DeleteMany, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, PyMongoError
 
+from utils.backfill import BackfillProgress
 from utils.checks import is_next
-from utils.embeds import green_embed, Embed
+from utils.embeds import green_embed, error_embed, Embed
 from utils.errors import interactions_error_handler
+from utils.indexes import QueryShape, ensure_indexes
+from utils.message_ledger import MessageLedger, LedgerEntry
+from utils.pagination import PageSource, CursorPageSource, AggregationPageSource, CallbackPageSource
+from utils.stats_buffer import StatsBuffer
+from utils.stats_export import ExportFormat, EXTENSIONS, export_stats
+from utils.stats_replica import StatsReplica
 from utils.views import PaginationView
 
 if TYPE_CHECKING:
@@ -21,33 +36,211 @@ if TYPE_CHECKING:
 
 log = getLogger(__name__)
 
-
-class ChannelEntry(TypedDict):
-    guild_id: int
-    channel_id: int
-    user_id: int
-    messages: int
-    words: int
-    reactions: int
-    files: int
+STATS_FLUSH_INTERVAL = float(getenv('STATS_FLUSH_INTERVAL', 10))
+STATS_MAX_BUFFER_SIZE = int(getenv('STATS_MAX_BUFFER_SIZE', 1000))
+STATS_DRAIN_ON_CLOSE = getenv('STATS_DRAIN_ON_CLOSE', 'true').lower() == 'true'
+STATS_HOURLY_BUCKETS_DAYS = int(getenv('STATS_HOURLY_BUCKETS_DAYS', 14))
+STATS_BACKFILL_CONCURRENCY = int(getenv('STATS_BACKFILL_CONCURRENCY', 4))
+STATS_BACKFILL_CHECKPOINT_EVERY = int(getenv('STATS_BACKFILL_CHECKPOINT_EVERY', 1000))
+STATS_BACKFILL_PROGRESS_INTERVAL = 5
+STATS_WEEKLY_CONCURRENCY = int(getenv('STATS_WEEKLY_CONCURRENCY', 5))
+STATS_REACTION_WORKER_INTERVAL = float(getenv('STATS_REACTION_WORKER_INTERVAL', 2))
+STATS_REACTION_MAX_ATTEMPTS = int(getenv('STATS_REACTION_MAX_ATTEMPTS', 5))
+STATS_REACTION_MAX_BACKOFF = 300
+STATS_LEDGER_SIZE = int(getenv('STATS_LEDGER_SIZE', 1_000_000))
+STATS_LEDGER_MAX_AGE_DAYS = int(getenv('STATS_LEDGER_MAX_AGE_DAYS', 0))
+STATS_LEDGER_PATH = getenv('STATS_LEDGER_PATH')
+STATS_REPLICA = getenv('STATS_REPLICA', 'false').lower() == 'true'
+STATS_EXPORT_DIR = getenv('STATS_EXPORT_DIR')
+
+STATS = ('messages', 'words', 'reactions', 'files')
+
+# The reactions counted in aggregate during a backfill are attributed to this user until they are attributed per user
+UNKNOWN_USER_ID = 0
 
 
 Stat = Literal['Messages', 'Words', 'Reactions', 'Files']
+WriteOperations = tuple[AgnosticCollection, list[UpdateOne]]
+Period = Literal['Day', 'Week', 'Month']
+ReactionsMode = Literal['exact', 'fast', 'deferred']
+Granularity = Literal['hour', 'day']
+
+PERIODS = {
+    'Day': timedelta(days=1),
+    'Week': timedelta(weeks=1),
+    'Month': timedelta(days=30)
+}
+
+
+def bucket_start(date: datetime, granularity: Granularity) -> datetime:
+    """Returns the start of the bucket the date belongs to."""
+
+    if granularity == 'day':
+        return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    return date.replace(minute=0, second=0, microsecond=0)
+
+
+def increment(query: dict, entry: Mapping[str, int], **on_insert: int) -> UpdateOne:
+    """Creates an upsert incrementing the stats of the matched document by the entry."""
+
+    update = {'$inc': {stat: entry[stat] for stat in STATS}}
+    if on_insert:
+        update['$setOnInsert'] = on_insert
+
+    return UpdateOne(query, update, upsert=True)
 
 
 class Stats(GroupCog, name='stats'):
     bot: 'NextBot'
     stats: AgnosticCollection
-    stats_weekly: AgnosticCollection
+    stats_buckets: AgnosticCollection
+    user_totals: AgnosticCollection
+    channel_totals: AgnosticCollection
     weekly_channels: AgnosticCollection
+    backfill_checkpoints: AgnosticCollection
+    reaction_queue: AgnosticCollection
+    buffer: StatsBuffer
+    ledger: MessageLedger
+    replica: StatsReplica | None
+
+    indexes = {
+        'stats': [
+            IndexModel([('channel_id', ASCENDING), ('user_id', ASCENDING)]),
+            IndexModel([('guild_id', ASCENDING), ('user_id', ASCENDING)])
+        ],
+        'stats_buckets': [
+            IndexModel(
+                [('channel_id', ASCENDING), ('user_id', ASCENDING), ('granularity', ASCENDING), ('start', ASCENDING)],
+                unique=True
+            ),
+            IndexModel([('guild_id', ASCENDING), ('start', ASCENDING)]),
+            IndexModel([('granularity', ASCENDING), ('start', ASCENDING)])
+        ],
+        'stats_user_totals': [
+            IndexModel([('guild_id', ASCENDING), ('user_id', ASCENDING)], unique=True),
+            *(IndexModel([('guild_id', ASCENDING), (stat, DESCENDING), ('_id', ASCENDING)]) for stat in STATS)
+        ],
+        'stats_channel_totals': [
+            IndexModel([('guild_id', ASCENDING), ('channel_id', ASCENDING)], unique=True),
+            *(IndexModel([('guild_id', ASCENDING), (stat, DESCENDING), ('_id', ASCENDING)]) for stat in STATS)
+        ],
+        'stats_weekly_channels': [IndexModel('guild_id')],
+        'stats_backfill': [IndexModel('channel_id', unique=True)],
+        'stats_reaction_queue': [IndexModel('message_id', unique=True)]
+    }
+    query_shapes = (
+        QueryShape('stats', {'channel_id': 0, 'user_id': 0}),
+        QueryShape('stats', {'guild_id': 0, 'user_id': 0}, [('messages', DESCENDING), ('_id', ASCENDING)]),
+        QueryShape('stats', {'channel_id': 0}, [('messages', DESCENDING), ('_id', ASCENDING)]),
+        QueryShape('stats', {'guild_id': 0}),
+        QueryShape('stats_buckets', {'guild_id': 0, 'start': {'$gte': datetime(2015, 1, 1)}}),
+        QueryShape('stats_user_totals', {'guild_id': 0}, [('messages', DESCENDING), ('_id', ASCENDING)]),
+        QueryShape('stats_user_totals', {'guild_id': 0, 'messages': {'$gt': 0}}),
+        QueryShape('stats_channel_totals', {'guild_id': 0}, [('messages', DESCENDING), ('_id', ASCENDING)]),
+        QueryShape('stats_weekly_channels', {'guild_id': 0}),
+        QueryShape('stats_backfill', {'channel_id': 0})
+    )
 
     def __init__(self, bot: 'NextBot'):
         self.bot = bot
         self.stats = self.bot.db['stats']
-        self.stats_weekly = self.bot.db['stats_weekly']
+        self.stats_buckets = self.bot.db['stats_buckets']
+        self.user_totals = self.bot.db['stats_user_totals']
+        self.channel_totals = self.bot.db['stats_channel_totals']
         self.weekly_channels = self.bot.db['stats_weekly_channels']
+        self.backfill_checkpoints = self.bot.db['stats_backfill']
+        self.reaction_queue = self.bot.db['stats_reaction_queue']
+        self.buffer = StatsBuffer(self.write_stats, STATS_MAX_BUFFER_SIZE)
+        self.ledger = MessageLedger(
+            STATS_LEDGER_SIZE,
+            timedelta(days=STATS_LEDGER_MAX_AGE_DAYS) if STATS_LEDGER_MAX_AGE_DAYS else None,
+            STATS_LEDGER_PATH
+        )
+        self.replica = StatsReplica() if STATS_REPLICA else None
+        # The writes of the collections that failed, retried alone with the next flush
+        self.failed_writes: list[WriteOperations] = []
+        # The reactions attribution worker backs off exponentially while it keeps failing
+        self.attribution_failures = 0
+        # The queued messages whose reactions were written but not removed from the queue yet
+        self.attributed_messages: set = set()
+        # The messages queued for the reactions attribution, whose reactions counted live are recorded
+        self.queued_reactions: set[int] = set()
+
+        self.live_since = discord.utils.time_snowflake(discord.utils.utcnow())
+        self.caught_up_channels: set[int] = set()
 
         self.weekly_stats.start()
+        self.flush_stats.start()
+        self.compact_stats.start()
+        self.attribute_reactions.start()
+
+    async def cog_load(self):
+        """Creates the indexes, records the offline gaps, builds the leaderboards if they are missing and warms the
+        stats replica.
+        """
+
+        await ensure_indexes(self.bot.db, self.indexes)
+        await self.record_offline_gaps()
+
+        async for entry in self.reaction_queue.find({}, {'message_id': 1}):
+            self.queued_reactions.add(entry['message_id'])
+
+        if await self.stats.find_one({}, {'_id': 1}) is not None and (
+            await self.user_totals.find_one({}, {'_id': 1}) is None
+            or await self.channel_totals.find_one({}, {'_id': 1}) is None
+        ):
+            log.info('The stats leaderboards are empty, building them from the stats')
+            await self.build_totals()
+
+        if self.replica is not None:
+            async with self.buffer.lock:
+                await self.replica.warm(self.stats)
+
+    async def record_offline_gaps(self):
+        """Saves the history sent while the bot was offline as a gap of each backfill checkpoint.
+
+        The listeners count everything from now on, so the checkpoints are moved to now and the backfill only has to
+        scan the saved gaps, never the messages that were counted live in between.
+        """
+
+        await self.backfill_checkpoints.update_many(
+            {'newest_id': {'$lt': self.live_since}},
+            [{
+                '$set': {
+                    'gaps': {
+                        '$concatArrays': [
+                            {'$ifNull': ['$gaps', []]},
+                            [{'after': '$newest_id', 'before': self.live_since}]
+                        ]
+                    },
+                    'newest_id': self.live_since,
+                    # The history before the checkpoint's creation, the newest_id moves forward from now on
+                    'oldest_id': {'$ifNull': ['$oldest_id', '$newest_id']}
+                }
+            }]
+        )
+
+        async for checkpoint in self.backfill_checkpoints.find({}, {'channel_id': 1}):
+            self.caught_up_channels.add(checkpoint['channel_id'])
+
+    async def cog_unload(self):
+        """Stops the background tasks and writes the buffered stats."""
+
+        self.weekly_stats.cancel()
+        self.flush_stats.cancel()
+        self.compact_stats.cancel()
+        self.attribute_reactions.cancel()
+
+        if STATS_DRAIN_ON_CLOSE:
+            await self.buffer.flush()
+            async with self.buffer.lock:
+                await self.retry_failed_writes()
+
+            if self.failed_writes:
+                log.error(f'Lost {sum(len(ops) for _, ops in self.failed_writes)} stats writes that kept failing')
+
+        self.ledger.close()
 
     async def cog_app_command_error(self, interaction: Interaction, error: app_commands.AppCommandError):
         """Handles the errors."""
@@ -65,67 +258,279 @@ class Stats(GroupCog, name='stats'):
         messages: int = 0,
         words: int = 0,
         reactions: int = 0,
-        files: int = 0
+        files: int = 0,
+        counted_at: datetime = None
     ):
-        """Updates the stats for the given channel id and user id. The values are the amount to increment by."""
-
-        existing_entry = await self.stats.find_one({'channel_id': channel_id, 'user_id': user_id})
-        if existing_entry is None:
-            entry = ChannelEntry(
-                guild_id=guild_id,
-                channel_id=channel_id,
-                user_id=user_id,
-                messages=messages,
-                words=words,
-                reactions=reactions,
-                files=files
+        """Updates the stats for the given channel id and user id. The values are the amount to increment by.
+
+        The update goes to the bucket of counted_at, now by default, and is written to the database with the next
+        flush.
+        """
+
+        hour = bucket_start(counted_at or discord.utils.utcnow(), 'hour')
+        await self.buffer.add(
+            (guild_id, channel_id, user_id, hour),
+            messages=messages,
+            words=words,
+            reactions=reactions,
+            files=files
+        )
+
+    def totals_operations(self, totals: dict[tuple[int, int, int], Mapping[str, int]]) -> list[WriteOperations]:
+        """Creates the upserts applying the deltas to the stats and to the users and channels leaderboards."""
+
+        users: dict[tuple[int, int], Counter] = defaultdict(Counter)
+        channels: dict[tuple[int, int], Counter] = defaultdict(Counter)
+        for (guild_id, channel_id, user_id), entry in totals.items():
+            if user_id != UNKNOWN_USER_ID:
+                users[guild_id, user_id].update(entry)
+            channels[guild_id, channel_id].update(entry)
+
+        return [
+            (
+                self.stats,
+                [
+                    increment({'channel_id': channel_id, 'user_id': user_id}, entry, guild_id=guild_id)
+                    for (guild_id, channel_id, user_id), entry in totals.items()
+                ]
+            ),
+            (
+                self.user_totals,
+                [
+                    increment({'guild_id': guild_id, 'user_id': user_id}, entry)
+                    for (guild_id, user_id), entry in users.items()
+                ]
+            ),
+            (
+                self.channel_totals,
+                [
+                    increment({'guild_id': guild_id, 'channel_id': channel_id}, entry)
+                    for (guild_id, channel_id), entry in channels.items()
+                ]
             )
+        ]
+
+    @staticmethod
+    async def write_operations(operations: list[WriteOperations]) -> list[WriteOperations]:
+        """Runs the operations as one unordered bulk write per collection.
 
-            return await self.stats.insert_one(entry)
+        Returns the operations of the collections whose write failed. They are never raised, since the other
+        collections have already been written and retrying them would count them twice.
+        """
 
-        await self.stats.update_one(
-            {'channel_id': channel_id, 'user_id': user_id},
-            {'$inc': {'messages': messages, 'words': words, 'reactions': reactions, 'files': files}}
+        operations = [(collection, ops) for collection, ops in operations if ops]
+        results = await gather(
+            *(collection.bulk_write(ops, ordered=False) for collection, ops in operations),
+            return_exceptions=True
         )
 
-    async def update_stats_weekly(
+        failed = []
+        for (collection, ops), result in zip(operations, results):
+            # The operations that didn't fail have already been applied, only the rejected ones are dropped
+            if isinstance(result, BulkWriteError):
+                log.error(f'Failed to write {len(result.details["writeErrors"])} stats entries: {result.details}')
+            elif isinstance(result, BaseException):
+                log.error(f'Failed to write {len(ops)} stats entries to {collection.name}, retrying later: {result}')
+                failed.append((collection, ops))
+
+        return failed
+
+    async def retry_failed_writes(self):
+        """Retries the writes that failed, the caller has to hold the buffer's lock."""
+
+        if self.failed_writes:
+            failed, self.failed_writes = self.failed_writes, []
+            self.failed_writes.extend(await self.write_operations(failed))
+
+    async def write_stats(
         self,
-        guild_id: int,
-        channel_id: int,
-        user_id: int,
-        messages: int = 0,
-        words: int = 0,
-        reactions: int = 0,
-        files: int = 0
+        deltas: dict[tuple[int, int, int, datetime], Counter],
+        granularity: Granularity = 'hour'
     ):
-        """Updates the stats for the given channel id and user id. The values are the amount to increment by."""
-
-        existing_entry = await self.stats_weekly.find_one({'channel_id': channel_id, 'user_id': user_id})
-        if existing_entry is None:
-            entry = ChannelEntry(
-                guild_id=guild_id,
-                channel_id=channel_id,
-                user_id=user_id,
-                messages=messages,
-                words=words,
-                reactions=reactions,
-                files=files
+        """Writes the stats deltas to the stats, the leaderboards and the buckets of the given granularity.
+
+        The writes of the collections that fail are kept and retried first on the next call, so the deltas are never
+        raised back to the buffer once any collection has them.
+        """
+
+        await self.retry_failed_writes()
+
+        totals: dict[tuple[int, int, int], Counter] = defaultdict(Counter)
+        bucket_operations = []
+        for (guild_id, channel_id, user_id, start), entry in deltas.items():
+            totals[guild_id, channel_id, user_id].update(entry)
+            bucket_operations.append(
+                increment(
+                    {'channel_id': channel_id, 'user_id': user_id, 'granularity': granularity, 'start': start},
+                    entry,
+                    guild_id=guild_id
+                )
             )
 
-            return await self.stats_weekly.insert_one(entry)
-
-        await self.stats_weekly.update_one(
-            {'channel_id': channel_id, 'user_id': user_id},
-            {'$inc': {'messages': messages, 'words': words, 'reactions': reactions, 'files': files}}
+        self.failed_writes.extend(
+            await self.write_operations([*self.totals_operations(totals), (self.stats_buckets, bucket_operations)])
         )
 
+        if self.replica is not None:
+            self.replica.apply(totals)
+
+        # The listeners have counted everything up to now in the channels without an offline gap in their history
+        if granularity == 'hour' and self.caught_up_channels:
+            try:
+                await self.backfill_checkpoints.update_many(
+                    {'channel_id': {'$in': list(self.caught_up_channels)}},
+                    {'$max': {'newest_id': discord.utils.time_snowflake(discord.utils.utcnow())}}
+                )
+            except PyMongoError as e:
+                log.error(f'Failed to move the backfill checkpoints of the caught up channels: {e}')
+
+    @loop(seconds=STATS_FLUSH_INTERVAL)
+    async def flush_stats(self):
+        """Periodically writes the buffered stats to the database."""
+
+        try:
+            await self.buffer.flush()
+        except Exception as e:
+            log.error(f'Failed to flush the stats buffer, retrying on the next flush: {e}')
+
+        # Retried even when nothing new was buffered, under the lock like every stats write
+        async with self.buffer.lock:
+            await self.retry_failed_writes()
+
+    @loop(time=time(hour=4, minute=0))
+    async def compact_stats(self):
+        """Compacts the old hourly stats buckets every day."""
+
+        try:
+            await self.compact_buckets()
+        except Exception as e:
+            log.error(f'Failed to compact the stats buckets, retrying tomorrow: {e}')
+
+    async def compact_buckets(self):
+        """Compacts the hourly stats buckets older than STATS_HOURLY_BUCKETS_DAYS into daily buckets."""
+
+        cutoff = bucket_start(discord.utils.utcnow() - timedelta(days=STATS_HOURLY_BUCKETS_DAYS), 'day')
+        old_hours = {'granularity': 'hour', 'start': {'$lt': cutoff}}
+
+        query = self.stats_buckets.aggregate([
+            {'$match': old_hours},
+            {
+                '$group': {
+                    '_id': {
+                        'guild_id': '$guild_id',
+                        'channel_id': '$channel_id',
+                        'user_id': '$user_id',
+                        'start': {'$dateTrunc': {'date': '$start', 'unit': 'day'}}
+                    },
+                    **{stat: {'$sum': f'${stat}'} for stat in STATS}
+                }
+            }
+        ])
+
+        operations = [
+            increment(
+                {
+                    'channel_id': entry['_id']['channel_id'],
+                    'user_id': entry['_id']['user_id'],
+                    'granularity': 'day',
+                    'start': entry['_id']['start']
+                },
+                entry,
+                guild_id=entry['_id']['guild_id']
+            )
+            async for entry in query
+        ]
+
+        if not operations:
+            return
+
+        # Ordered, so that the hourly buckets are only removed once all the daily buckets are written
+        await self.stats_buckets.bulk_write([*operations, DeleteMany(old_hours)])
+        log.info(f'Compacted the hourly stats buckets older than {cutoff} into {len(operations)} daily buckets')
+
+    @staticmethod
+    def range_match(guild_id: int, start: datetime, end: datetime = None) -> dict:
+        """Creates the $match stage of the guild's buckets in the [start, end) range.
+
+        Ranges older than STATS_HOURLY_BUCKETS_DAYS are only as precise as the daily buckets.
+        """
+
+        date_range = {'$gte': start}
+        if end is not None:
+            date_range['$lt'] = end
+
+        return {'$match': {'guild_id': guild_id, 'start': date_range}}
+
+    @staticmethod
+    def leaderboard_stages(group_by: Literal['user_id', 'channel_id'], stat: str) -> list[dict]:
+        """Creates the stages aggregating the matched buckets into the given stat leaderboard.
+
+        The entries have the same shape as the entries of the all time leaderboards.
+        """
+
+        stages = []
+        if group_by == 'user_id':
+            stages.append({'$match': {'user_id': {'$ne': UNKNOWN_USER_ID}}})
+
+        return [
+            *stages,
+            {
+                '$group': {
+                    '_id': f'${group_by}',
+                    stat: {'$sum': f'${stat}'},
+                }
+            },
+            {'$project': {'_id': 0, group_by: '$_id', stat: 1}},
+            # Sorted by id too, so that tied entries keep the same order from one page to another
+            {'$sort': {stat: -1, group_by: 1}}
+        ]
+
+    def range_leaderboard(
+        self,
+        guild_id: int,
+        group_by: Literal['user_id', 'channel_id'],
+        stat: str,
+        start: datetime,
+        end: datetime = None
+    ) -> list[dict]:
+        """Creates the pipeline aggregating the given stat leaderboard from the buckets in the [start, end) range."""
+
+        return [self.range_match(guild_id, start, end), *self.leaderboard_stages(group_by, stat)]
+
+    @staticmethod
+    def parse_range(
+        period: Period | None,
+        since: str | None,
+        until: str | None
+    ) -> tuple[datetime | None, datetime | None, str]:
+        """Parses the period or the custom YYYY-MM-DD dates into a date range and its description.
+
+        Raises ValueError if a date is invalid.
+        """
+
+        if since is not None or until is not None:
+            start = datetime.strptime(since, '%Y-%m-%d') if since is not None else datetime(2015, 1, 1)
+            end = datetime.strptime(until, '%Y-%m-%d') + timedelta(days=1) if until is not None else None
+
+            return start, end, f'{since or "start"} - {until or "now"}'
+
+        if period is not None:
+            return discord.utils.utcnow() - PERIODS[period], None, f'Last {period.lower()}'
+
+        return None, None, 'All time'
+
     @GroupCog.listener('on_message')
     async def save_message(self, message: discord.Message):
         """Saves the message stats."""
 
+        if message.guild is None:  # Only the guilds' stats are counted
+            return
+
         words = len(message.content.split()) if message.content else 0
         files = len(message.attachments)
 
+        self.ledger.add(message.id, message.author.id, words, files)
+
         await self.update_stats(
             message.guild.id,
             message.channel.id,
@@ -134,77 +539,204 @@ class Stats(GroupCog, name='stats'):
             words=words,
             files=files
         )
-        await self.update_stats_weekly(
-            message.guild.id,
-            message.channel.id,
-            message.author.id,
-            messages=1,
-            words=words,
-            files=files
+
+    async def remove_message_stats(
+        self,
+        guild_id: int,
+        channel_id: int,
+        message_id: int,
+        cached_message: discord.Message | None
+    ):
+        """Removes the stats of a deleted message, looked up in the ledger or in the message cache."""
+
+        entry = self.ledger.pop(message_id)
+        if entry is None:
+            if cached_message is None:
+                return
+
+            words = len(cached_message.content.split()) if cached_message.content else 0
+            entry = LedgerEntry(cached_message.author.id, words, len(cached_message.attachments))
+
+        await self.update_stats(
+            guild_id,
+            channel_id,
+            entry.author_id,
+            messages=-1,
+            words=-entry.words,
+            files=-entry.files,
+            # Removed from the bucket the message was counted in
+            counted_at=discord.utils.snowflake_time(message_id)
         )
 
     @GroupCog.listener('on_raw_message_delete')
     async def save_message_remove(self, payload: discord.RawMessageDeleteEvent):
         """Saves the removed message stats."""
 
-        message = payload.cached_message
-        if message is None:
+        if payload.guild_id is None:
             return
 
-        words = -len(message.content.split()) if message.content else 0
-        files = -len(message.attachments)
-
-        await self.update_stats(
-            payload.guild_id,
-            payload.channel_id,
-            message.author.id,
-            messages=-1,
-            words=words,
-            files=files
-        )
-        await self.update_stats_weekly(
+        await self.remove_message_stats(
             payload.guild_id,
             payload.channel_id,
-            message.author.id,
-            messages=-1,
-            words=words,
-            files=files
+            payload.message_id,
+            payload.cached_message
         )
 
-    @GroupCog.listener('on_message_edit')
-    async def save_message_edit(self, before: discord.Message, after: discord.Message):
+    @GroupCog.listener('on_raw_bulk_message_delete')
+    async def save_bulk_message_remove(self, payload: discord.RawBulkMessageDeleteEvent):
+        """Saves the bulk removed messages stats."""
+
+        if payload.guild_id is None:
+            return
+
+        cached_messages = {message.id: message for message in payload.cached_messages}
+        for message_id in payload.message_ids:
+            await self.remove_message_stats(
+                payload.guild_id,
+                payload.channel_id,
+                message_id,
+                cached_messages.get(message_id)
+            )
+
+    @GroupCog.listener('on_raw_message_edit')
+    async def save_message_edit(self, payload: discord.RawMessageUpdateEvent):
         """Saves the message edit stats."""
 
-        before_words = len(before.content.split()) if before.content else 0
-        after_words = len(after.content.split()) if after.content else 0
+        if payload.guild_id is None:
+            return
+
+        if 'content' not in payload.data:  # Not a content edit, e.g. an embed got resolved
+            return
+
+        entry = self.ledger.get(payload.message_id)
+        if entry is None:
+            message = payload.cached_message
+            if message is None:
+                return
+
+            words = len(message.content.split()) if message.content else 0
+            entry = LedgerEntry(message.author.id, words, len(message.attachments))
+
+        after_words = len(payload.data['content'].split())
+        if entry.words != after_words:
+            self.ledger.set_words(payload.message_id, after_words)
 
-        if before_words != after_words:
             await self.update_stats(
-                after.guild.id,
-                after.channel.id,
-                after.author.id,
-                words=after_words - before_words
-            )
-            await self.update_stats_weekly(
-                after.guild.id,
-                after.channel.id,
-                after.author.id,
-                words=after_words - before_words
+                payload.guild_id,
+                payload.channel_id,
+                entry.author_id,
+                words=after_words - entry.words,
+                counted_at=discord.utils.snowflake_time(payload.message_id)
             )
 
     @GroupCog.listener('on_raw_reaction_add')
     async def save_reaction(self, payload: discord.RawReactionActionEvent):
         """Saves the reaction."""
 
+        if payload.guild_id is None:
+            return
+
+        if payload.message_id in self.queued_reactions:
+            await self.record_live_reaction(payload, 'live_added')
+
         await self.update_stats(payload.guild_id, payload.channel_id, payload.user_id, reactions=1)
-        await self.update_stats_weekly(payload.guild_id, payload.channel_id, payload.user_id, reactions=1)
 
     @GroupCog.listener('on_raw_reaction_remove')
     async def save_reaction_remove(self, payload: discord.RawReactionActionEvent):
         """Saves the reaction removal."""
 
+        if payload.guild_id is None:
+            return
+
+        if payload.message_id in self.queued_reactions:
+            await self.record_live_reaction(payload, 'live_removed')
+
         await self.update_stats(payload.guild_id, payload.channel_id, payload.user_id, reactions=-1)
-        await self.update_stats_weekly(payload.guild_id, payload.channel_id, payload.user_id, reactions=-1)
+
+    async def record_live_reaction(
+        self,
+        payload: discord.RawReactionActionEvent,
+        field: Literal['live_added', 'live_removed']
+    ):
+        """Records a reaction counted live on a message queued for the reactions attribution, so it isn't counted
+        again when the message's reactions are attributed.
+        """
+
+        try:
+            await self.reaction_queue.update_one(
+                {'message_id': payload.message_id},
+                {'$addToSet': {field: [str(payload.emoji), payload.user_id]}},
+                upsert=True
+            )
+        except PyMongoError as e:
+            log.error(f'Failed to record a live reaction on a queued message: {e}')
+
+    async def get_totals(self, guild_id: int, key: Literal['user_id', 'channel_id'], value: int) -> Mapping | None:
+        """Gets the total stats of a user or a channel, from the replica if it is enabled."""
+
+        if self.replica is not None:
+            guild = self.replica.get(guild_id)
+            return guild.user_totals(value) if key == 'user_id' else guild.channel_totals(value)
+
+        collection = self.user_totals if key == 'user_id' else self.channel_totals
+        return await collection.find_one({'guild_id': guild_id, key: value})
+
+    def leaderboard_source(self, guild_id: int, group_by: Literal['user_id', 'channel_id'], stat: str) -> PageSource:
+        """Creates the page source of the all time users or channels leaderboard, served by the replica if enabled."""
+
+        if self.replica is not None:
+            guild = self.replica.get(guild_id)
+            if group_by == 'user_id':
+                return CallbackPageSource(
+                    guild.count_users(UNKNOWN_USER_ID),
+                    lambda limit: guild.users_leaderboard(stat, limit, UNKNOWN_USER_ID),
+                    25
+                )
+
+            return CallbackPageSource(guild.count_channels(), lambda limit: guild.channels_leaderboard(stat, limit), 25)
+
+        collection = self.user_totals if group_by == 'user_id' else self.channel_totals
+        return CursorPageSource(collection, {'guild_id': guild_id}, [(stat, -1)], 25)
+
+    def breakdown_source(
+        self,
+        guild_id: int,
+        key: Literal['user_id', 'channel_id'],
+        value: int,
+        stat: str
+    ) -> PageSource:
+        """Creates the page source of a user's channels or a channel's users, served by the replica if enabled."""
+
+        if self.replica is not None:
+            guild = self.replica.get(guild_id)
+            if key == 'user_id':
+                return CallbackPageSource(
+                    guild.count_user_channels(value),
+                    lambda limit: guild.user_channels(value, stat, limit),
+                    25
+                )
+
+            return CallbackPageSource(
+                guild.count_channel_users(value, UNKNOWN_USER_ID),
+                lambda limit: guild.channel_users(value, stat, limit, UNKNOWN_USER_ID),
+                25
+            )
+
+        if key == 'user_id':
+            query = {'guild_id': guild_id, 'user_id': value}
+        else:
+            query = {'channel_id': value, 'user_id': {'$ne': UNKNOWN_USER_ID}}
+
+        return CursorPageSource(self.stats, query, [(stat, -1)], 25)
+
+    async def get_rank(self, guild_id: int, user_id: int, stat: str, value: int) -> int:
+        """Gets the user's position in the users leaderboard of the stat, from the replica if it is enabled."""
+
+        if self.replica is not None:
+            return self.replica.get(guild_id).user_rank(user_id, stat, UNKNOWN_USER_ID)
+
+        better_users = await self.user_totals.count_documents({'guild_id': guild_id, stat: {'$gt': value}})
+        return better_users + 1
 
     @app_commands.command()
     @app_commands.guild_only()
@@ -214,20 +746,8 @@ class Stats(GroupCog, name='stats'):
 
         user = user or interaction.user
         if stat is None:
-            query = self.stats.aggregate([
-                {'$match': {'guild_id': interaction.guild_id, 'user_id': user.id}},
-                {
-                    '$group': {
-                        '_id': '$user_id',
-                        'messages': {'$sum': '$messages'},
-                        'words': {'$sum': '$words'},
-                        'reactions': {'$sum': '$reactions'},
-                        'files': {'$sum': '$files'}
-                    }
-                }
-            ])
-
-            async for entry in query:
+            entry = await self.get_totals(interaction.guild_id, 'user_id', user.id)
+            if entry is not None:
                 embed = Embed(
                     title='Overall Stats',
                     description=user.mention
@@ -242,51 +762,62 @@ class Stats(GroupCog, name='stats'):
 
         stat = stat.lower()
 
-        query = self.stats.find({'guild_id': interaction.guild_id, 'user_id': user.id}).sort(stat, -1)
-        data = [entry async for entry in query]
+        source = self.breakdown_source(interaction.guild_id, 'user_id', user.id, stat)
 
         view = PaginationView(
             f'{stat.title()} Stats',
-            data,
-            25,
+            source,
             lambda d: (f'<#{e["channel_id"]}> - **{e[stat]:,}** {stat}' for e in d),
             interaction,
             user.mention + '\n\n',
             user.display_avatar.url
         )
 
-        await interaction.response.send_message(embed=view.embed(), view=view)
+        await interaction.response.send_message(embed=await view.embed(), view=view)
 
 
     @app_commands.command()
     @app_commands.guild_only()
-    @app_commands.describe(stat='The stat to show leaderboard for')
-    async def users(self, interaction: Interaction, stat: Stat):
+    @app_commands.describe(
+        stat='The stat to show leaderboard for',
+        period='The period to show leaderboard for, all time if left empty',
+        since='Show leaderboard since this date (YYYY-MM-DD)',
+        until='Show leaderboard until this date, inclusive (YYYY-MM-DD)'
+    )
+    async def users(
+        self,
+        interaction: Interaction,
+        stat: Stat,
+        period: Period = None,
+        since: str = None,
+        until: str = None
+    ):
         """Show users leaderboard for the given stat."""
 
-        stat = stat.lower()
-        query = self.stats.aggregate([
-            {'$match': {'guild_id': interaction.guild_id}},
-            {
-                '$group': {
-                    '_id': '$user_id',
-                    'total': {'$sum': f'${stat}'},
-                }
-            },
-            {'$sort': {'total': -1}}
-        ])
+        try:
+            start, end, range_text = self.parse_range(period, since, until)
+        except ValueError:
+            return await error_embed(interaction, 'Invalid date! Use the YYYY-MM-DD format')
 
-        data = [entry async for entry in query]
+        stat = stat.lower()
+        if start is not None:
+            source = AggregationPageSource(
+                self.stats_buckets,
+                self.range_leaderboard(interaction.guild_id, 'user_id', stat, start, end),
+                25
+            )
+        else:
+            source = self.leaderboard_source(interaction.guild_id, 'user_id', stat)
 
         view = PaginationView(
             f'Users {stat.title()} Leaderboard',
-            data,
-            25,
-            lambda d: (f'<@{e["_id"]}> - **{e["total"]:,}** {stat}' for e in d),
-            interaction
+            source,
+            lambda d: (f'<@{e["user_id"]}> - **{e[stat]:,}** {stat}' for e in d),
+            interaction,
+            f'*{range_text}*\n\n'
         )
 
-        await interaction.response.send_message(embed=view.embed(), view=view)
+        await interaction.response.send_message(embed=await view.embed(), view=view)
 
     @app_commands.command()
     @app_commands.guild_only()
@@ -301,20 +832,8 @@ class Stats(GroupCog, name='stats'):
 
         channel = channel or interaction.channel
         if stat is None:
-            query = self.stats.aggregate([
-                {'$match': {'channel_id': channel.id}},
-                {
-                    '$group': {
-                        '_id': '$channel_id',
-                        'messages': {'$sum': '$messages'},
-                        'words': {'$sum': '$words'},
-                        'reactions': {'$sum': '$reactions'},
-                        'files': {'$sum': '$files'}
-                    }
-                }
-            ])
-
-            async for entry in query:
+            entry = await self.get_totals(interaction.guild_id, 'channel_id', channel.id)
+            if entry is not None:
                 embed = Embed(
                     title='Overall Stats',
                     description=channel.mention
@@ -328,49 +847,84 @@ class Stats(GroupCog, name='stats'):
 
         stat = stat.lower()
 
-        query = self.stats.find({'channel_id': channel.id}).sort(stat, -1)
-        data = [entry async for entry in query]
+        source = self.breakdown_source(interaction.guild_id, 'channel_id', channel.id, stat)
 
         view = PaginationView(
             f'{stat.title()} Stats',
-            data,
-            25,
+            source,
             lambda d: (f'<@{e["user_id"]}> - **{e[stat]:,}** {stat}' for e in d),
             interaction,
             channel.mention + '\n\n'
         )
 
-        await interaction.response.send_message(embed=view.embed(), view=view)
+        await interaction.response.send_message(embed=await view.embed(), view=view)
 
     @app_commands.command()
     @app_commands.guild_only()
-    @app_commands.describe(stat='The stat to show leaderboard for')
-    async def channels(self, interaction: Interaction, stat: Stat):
+    @app_commands.describe(
+        stat='The stat to show leaderboard for',
+        period='The period to show leaderboard for, all time if left empty',
+        since='Show leaderboard since this date (YYYY-MM-DD)',
+        until='Show leaderboard until this date, inclusive (YYYY-MM-DD)'
+    )
+    async def channels(
+        self,
+        interaction: Interaction,
+        stat: Stat,
+        period: Period = None,
+        since: str = None,
+        until: str = None
+    ):
         """Show channels leaderboard for the given stat."""
 
-        stat = stat.lower()
-        query = self.stats.aggregate([
-            {'$match': {'guild_id': interaction.guild_id}},
-            {
-                '$group': {
-                    '_id': '$channel_id',
-                    'total': {'$sum': f'${stat}'},
-                }
-            },
-            {'$sort': {'total': -1}}
-        ])
+        try:
+            start, end, range_text = self.parse_range(period, since, until)
+        except ValueError:
+            return await error_embed(interaction, 'Invalid date! Use the YYYY-MM-DD format')
 
-        data = [entry async for entry in query]
+        stat = stat.lower()
+        if start is not None:
+            source = AggregationPageSource(
+                self.stats_buckets,
+                self.range_leaderboard(interaction.guild_id, 'channel_id', stat, start, end),
+                25
+            )
+        else:
+            source = self.leaderboard_source(interaction.guild_id, 'channel_id', stat)
 
         view = PaginationView(
             f'Channels {stat.title()} Leaderboard',
-            data,
-            25,
-            lambda d: (f'<#{e["_id"]}> - **{e["total"]:,}** {stat}' for e in d),
-            interaction
+            source,
+            lambda d: (f'<#{e["channel_id"]}> - **{e[stat]:,}** {stat}' for e in d),
+            interaction,
+            f'*{range_text}*\n\n'
         )
 
-        await interaction.response.send_message(embed=view.embed(), view=view)
+        await interaction.response.send_message(embed=await view.embed(), view=view)
+
+    @app_commands.command()
+    @app_commands.guild_only()
+    @app_commands.describe(user='The user to check the rank of', stat='The stat to check the rank for')
+    async def rank(self, interaction: Interaction, user: discord.Member = None, stat: Stat = None):
+        """Check a user's position in the users leaderboards."""
+
+        user = user or interaction.user
+        entry = await self.get_totals(interaction.guild_id, 'user_id', user.id)
+        if entry is None:
+            return await error_embed(interaction, f'{user.mention} doesn\'t have any stats yet!')
+
+        embed = Embed(title='Rank', description=user.mention)
+        embed.set_thumbnail(url=user.display_avatar.url)
+
+        for stat_name in (stat.lower(),) if stat is not None else STATS:
+            rank = await self.get_rank(interaction.guild_id, user.id, stat_name, entry[stat_name])
+            embed.add_field(
+                name=stat_name.title(),
+                value=f'**#{rank:,}** with **{entry[stat_name]:,}** {stat_name}',
+                inline=False
+            )
+
+        await interaction.response.send_message(embed=embed)
 
     @app_commands.command(name='weekly-channel')
     @app_commands.guild_only()
@@ -388,126 +942,452 @@ class Stats(GroupCog, name='stats'):
 
         await green_embed(interaction, f'Set the weekly channel to {channel.mention}!')
 
+    @app_commands.command()
+    @app_commands.guild_only()
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.checks.has_permissions(administrator=True)
+    @app_commands.describe(export_format='The format of the file')
+    @app_commands.rename(export_format='format')
+    async def export(self, interaction: Interaction, export_format: ExportFormat = 'csv'):
+        """Export the server's stats to a file."""
+
+        await interaction.response.defer()
+        await self.buffer.flush()
+
+        filename = f'stats-{interaction.guild_id}.{EXTENSIONS[export_format]}'
+        with TemporaryFile() as file:
+            rows = await export_stats(self.stats, interaction.guild_id, file, export_format)
+            size = file.tell()
+            file.seek(0)
+
+            if size <= interaction.guild.filesize_limit:
+                return await green_embed(
+                    interaction,
+                    f'Exported **{rows:,}** stats entries!',
+                    file=discord.File(file, filename)
+                )
+
+            if STATS_EXPORT_DIR is None:
+                return await error_embed(interaction, 'The export is too big to be uploaded!')
+
+            path = join(STATS_EXPORT_DIR, filename)
+            with open(path, 'wb') as export_file:
+                await to_thread(copyfileobj, file, export_file)
+
+        await green_embed(
+            interaction,
+            f'Exported **{rows:,}** stats entries to `{path}`, it was too big to be uploaded!'
+        )
+
+    async def scan_history(
+        self,
+        channel: discord.abc.GuildChannel,
+        progress: BackfillProgress,
+        history: AsyncIterator[discord.Message],
+        checkpoint_field: str,
+        reactions_mode: ReactionsMode
+    ):
+        """Counts the stats of the history, writing them and moving the checkpoint every few messages.
+
+        In the exact reactions mode every reaction's users are fetched. Otherwise, the reaction counts are attributed
+        to UNKNOWN_USER_ID, and in the deferred mode the messages are queued for the reactions attribution worker.
+
+        A crash between writing a chunk and moving the checkpoint counts that chunk twice on the next run.
+        """
+
+        data: dict[tuple[int, int, int, datetime], Counter] = defaultdict(Counter)
+        deferred_reactions = []
+        last_message_id = None
+        scanned = 0
+
+        async def write_chunk():
+            if data:
+                # Under the buffer's lock, like the flushes, so the leaderboards aren't rebuilt meanwhile
+                async with self.buffer.lock:
+                    await self.write_stats(data, 'day')
+                data.clear()
+
+            if deferred_reactions:
+                # Upserted, the live reactions may already have been recorded on the message
+                await self.reaction_queue.bulk_write([
+                    UpdateOne({'message_id': entry['message_id']}, {'$set': entry}, upsert=True)
+                    for entry in deferred_reactions
+                ], ordered=False)
+                deferred_reactions.clear()
+
+            if last_message_id is not None:
+                await self.backfill_checkpoints.update_one(
+                    {'channel_id': channel.id},
+                    {'$set': {checkpoint_field: last_message_id}}
+                )
+
+        async for message in history:
+            progress.advance(channel, message)
+
+            day = bucket_start(message.created_at, 'day')
+            entry = data[channel.guild.id, channel.id, message.author.id, day]
+            entry['messages'] += 1
+            entry['files'] += len(message.attachments)
+            if message.content:
+                entry['words'] += len(message.content.split())
+
+            for reaction in message.reactions:
+                if reactions_mode == 'exact':
+                    async for user in reaction.users():
+                        data[channel.guild.id, channel.id, user.id, day]['reactions'] += 1
+                else:
+                    data[channel.guild.id, channel.id, UNKNOWN_USER_ID, day]['reactions'] += reaction.count
+
+            if reactions_mode == 'deferred' and message.reactions:
+                self.queued_reactions.add(message.id)
+                deferred_reactions.append({
+                    'guild_id': channel.guild.id,
+                    'channel_id': channel.id,
+                    'message_id': message.id,
+                    'day': day,
+                    'reactions': [[str(reaction.emoji), reaction.count] for reaction in message.reactions]
+                })
+
+            last_message_id = message.id
+            scanned += 1
+            if scanned % STATS_BACKFILL_CHECKPOINT_EVERY == 0:
+                await write_chunk()
+                last_message_id = None
+
+        await write_chunk()
+
+    async def backfill_channel(
+        self,
+        channel: discord.abc.GuildChannel,
+        progress: BackfillProgress,
+        checkpoint: dict,
+        reactions_mode: ReactionsMode
+    ):
+        """Counts the stats of the channel's history that hasn't been counted yet.
+
+        The listeners count everything since the checkpoint was created, except while the bot was offline. Those
+        gaps are scanned first, oldest first, then the history before oldest_id, if it isn't complete yet.
+        """
+
+        oldest_id = checkpoint['oldest_id']
+        progress.start_channel(channel, discord.utils.snowflake_time(oldest_id), channel.created_at)
+
+        for gap in checkpoint.get('gaps', []):
+            history = channel.history(
+                limit=None,
+                after=discord.Object(gap['after']),
+                before=discord.Object(gap['before']),
+                oldest_first=True
+            )
+            # The gap being scanned is always the first one, its start moves with the scan
+            await self.scan_history(channel, progress, history, 'gaps.0.after', reactions_mode)
+
+            await self.backfill_checkpoints.update_one({'channel_id': channel.id}, {'$pop': {'gaps': -1}})
+
+        if not checkpoint.get('complete'):
+            history = channel.history(limit=None, before=discord.Object(oldest_id))
+            await self.scan_history(channel, progress, history, 'oldest_id', reactions_mode)
+
+            await self.backfill_checkpoints.update_one({'channel_id': channel.id}, {'$set': {'complete': True}})
+
+    async def get_checkpoint(self, channel: discord.abc.GuildChannel) -> dict:
+        """Gets the backfill checkpoint of the channel, creating it if it doesn't exist yet."""
+
+        checkpoint = await self.backfill_checkpoints.find_one({'channel_id': channel.id})
+        if checkpoint is not None:
+            return checkpoint
+
+        checkpoint = {
+            'guild_id': channel.guild.id,
+            'channel_id': channel.id,
+            'newest_id': self.live_since,
+            'oldest_id': self.live_since
+        }
+        self.caught_up_channels.add(channel.id)
+
+        # Channels cached before checkpoints existed are considered complete up to now
+        if await self.stats.find_one({'channel_id': channel.id}) is not None:
+            checkpoint['complete'] = True
+
+        await self.backfill_checkpoints.insert_one(checkpoint)
+        return checkpoint
+
     @commands.command()
     @is_next()
     @commands.guild_only()
-    async def cache_server(self, ctx: Context):
-        """Caches the messages in the server."""
+    async def cache_server(
+        self,
+        ctx: Context,
+        reactions: ReactionsMode = 'deferred',
+        concurrency: int = STATS_BACKFILL_CONCURRENCY
+    ):
+        """Caches the messages in the server that haven't been counted yet, scanning several channels at once.
+
+        Runs can be interrupted and resumed, and rerun later to cache the messages sent while the bot was offline.
+        The reactions mode trades the accuracy of the users reactions stats for speed, see scan_history.
+        """
 
+        await self.buffer.flush()
+
+        channels = []
         for channel in ctx.guild.channels:
             if isinstance(channel, (discord.CategoryChannel, discord.ForumChannel)):
                 continue
 
-            await green_embed(ctx, f'Caching messages stats in {channel.mention}...')
-
-            if await self.stats.find_one({'channel_id': channel.id}) is not None:  # Already cached
+            checkpoint = await self.get_checkpoint(channel)
+            if checkpoint.get('complete') and not checkpoint.get('gaps'):  # Already cached
                 continue
 
-            data: dict[int, ChannelEntry] = defaultdict(
-                lambda: ChannelEntry(
-                    guild_id=0,
-                    channel_id=0,
-                    user_id=0,
-                    messages=0,
-                    words=0,
-                    reactions=0,
-                    files=0
-                )
-            )
-            async for message in channel.history(limit=None):
-                entry = data[message.author.id]
-                entry['messages'] += 1
-                entry['files'] += len(message.attachments)
-                if message.content:
-                    entry['words'] += len(message.content.split())
-
-                for reaction in message.reactions:
-                    async for user in reaction.users():
-                        data[user.id]['reactions'] += 1
+            channels.append((channel, checkpoint))
 
-            entries = []
-            for user_id, entry in data.items():
-                entry['guild_id'] = ctx.guild.id
-                entry['channel_id'] = channel.id
-                entry['user_id'] = user_id
-                entries.append(entry)
+        progress = BackfillProgress(len(channels))
+        progress_message = await green_embed(ctx, progress.describe())
+        semaphore = Semaphore(concurrency)
+        failed_channels = []
 
-            if entries:
-                await self.stats.insert_many(entries)
+        async def backfill(channel: discord.abc.GuildChannel, checkpoint: dict):
+            async with semaphore:
+                try:
+                    await self.backfill_channel(channel, progress, checkpoint, reactions)
+                except discord.Forbidden:
+                    log.warning(f'Couldn\'t read the history of the {channel} channel!')
+                except Exception as e:
+                    # The channel resumes from its checkpoint on the next run, the other channels keep going
+                    log.error(f'Failed to cache the {channel} channel: {e}')
+                    failed_channels.append(channel)
+                finally:
+                    progress.finish_channel(channel)
+
+        task = ensure_future(gather(*(backfill(channel, checkpoint) for channel, checkpoint in channels)))
+        while not task.done():
+            await wait({task}, timeout=STATS_BACKFILL_PROGRESS_INTERVAL)
+
+            try:
+                await progress_message.edit(embed=Embed(description=progress.describe()))
+            except discord.HTTPException:
+                pass
+
+        await task
+
+        if failed_channels:
+            mentions = ', '.join(channel.mention for channel in failed_channels)
+            return await error_embed(
+                ctx,
+                f'Caching failed in {mentions}, run it again to resume!',
+                delete_after=None,
+                content=ctx.author.mention
+            )
 
         await green_embed(ctx, 'Caching done!', content=ctx.author.mention)
 
-    @loop(time=time(hour=19, minute=0))
-    async def weekly_stats(self):
-        """Posts the weekly stats on Sundays 19 UTC."""
+    @loop(seconds=STATS_REACTION_WORKER_INTERVAL)
+    async def attribute_reactions(self):
+        """Attributes the reactions of a message queued by a deferred backfill to the users who reacted.
+
+        Only one message is handled per iteration, so the worker stays well below the rate limits. After an error,
+        the worker backs off and the message is retried, up to STATS_REACTION_MAX_ATTEMPTS times.
+        """
+
+        entry = None
+        try:
+            # The entries without reactions only have the live reactions, their message hasn't been queued yet
+            entry = await self.reaction_queue.find_one({'reactions': {'$exists': True}})
+            if entry is None:
+                return
+
+            # Written already, only its removal from the queue failed
+            if entry['_id'] not in self.attributed_messages:
+                await self.attribute_message_reactions(entry)
+                self.attributed_messages.add(entry['_id'])
+
+            await self.reaction_queue.delete_one({'_id': entry['_id']})
+            self.attributed_messages.discard(entry['_id'])
+            self.queued_reactions.discard(entry['message_id'])
+        except (discord.HTTPException, PyMongoError) as e:
+            self.attribution_failures += 1
+            backoff = min(STATS_REACTION_WORKER_INTERVAL * 2 ** self.attribution_failures, STATS_REACTION_MAX_BACKOFF)
+            log.warning(f'Failed to attribute the reactions of a queued message, retrying in {backoff}s: {e}')
+
+            if entry is not None and entry['_id'] not in self.attributed_messages:
+                await self.record_attribution_failure(entry)
+
+            await sleep(backoff)
+        else:
+            self.attribution_failures = 0
+
+    async def record_attribution_failure(self, entry: dict):
+        """Counts the failed attempt of the queued message, and drops it after too many attempts."""
+
+        try:
+            if entry.get('attempts', 0) + 1 >= STATS_REACTION_MAX_ATTEMPTS:
+                log.error(f'Dropping the reactions of message {entry["message_id"]} after too many failed attempts')
+                await self.reaction_queue.delete_one({'_id': entry['_id']})
+                self.queued_reactions.discard(entry['message_id'])
+            else:
+                await self.reaction_queue.update_one({'_id': entry['_id']}, {'$inc': {'attempts': 1}})
+        except PyMongoError as e:
+            log.error(f'Failed to record a failed reactions attribution: {e}')
+
+    async def attribute_message_reactions(self, entry: dict):
+        """Moves the reactions counted by the backfill from UNKNOWN_USER_ID to the users who reacted.
+
+        At most as many reactions are moved as were counted by the backfill. The users whose reaction was added after
+        the backfill have been counted by the listeners already, so they are skipped. The users who removed their
+        reaction since then were counted -1 by the listeners, so the reaction they had is attributed to them.
+        """
+
+        channel = self.bot.get_channel(entry['channel_id'])
+        try:
+            message = await channel.fetch_message(entry['message_id']) if channel is not None else None
+        except (discord.NotFound, discord.Forbidden):
+            message = None
 
-        await self.bot.wait_until_ready()
-
-        now = discord.utils.utcnow()
-        if now.weekday() != 6:
+        if message is None:
             return
 
-        async for entry in self.weekly_channels.find():
-            channel = self.bot.get_channel(entry['channel_id'])
-            if channel is None:
+        live_added = {(emoji, user_id) for emoji, user_id in entry.get('live_added', [])}
+        live_removed = {(emoji, user_id) for emoji, user_id in entry.get('live_removed', [])} - live_added
+        data: dict[tuple[int, int, int, datetime], Counter] = defaultdict(Counter)
+
+        def attribute(user_id: int):
+            data[entry['guild_id'], entry['channel_id'], user_id, entry['day']]['reactions'] += 1
+            data[entry['guild_id'], entry['channel_id'], UNKNOWN_USER_ID, entry['day']]['reactions'] -= 1
+
+        reactions = {str(reaction.emoji): reaction for reaction in message.reactions}
+        for emoji, count in entry['reactions']:
+            removed = [user_id for removed_emoji, user_id in live_removed if removed_emoji == emoji][:count]
+            for user_id in removed:
+                attribute(user_id)
+
+            remaining = count - len(removed)
+            if remaining <= 0 or emoji not in reactions:
                 continue
 
-            for stat in ('messages', 'words', 'reactions', 'files'):
-                # Channels
-                query = self.stats_weekly.aggregate([
-                    {'$match': {'guild_id': entry['guild_id']}},
+            async for user in reactions[emoji].users():
+                if (emoji, user.id) in live_added:
+                    continue
+
+                attribute(user.id)
+                remaining -= 1
+                if not remaining:
+                    break
+
+        if data:
+            async with self.buffer.lock:
+                await self.write_stats(data, 'day')
+
+    @attribute_reactions.before_loop
+    async def before_attribute_reactions(self):
+        """Waits until the bot is ready."""
+
+        await self.bot.wait_until_ready()
+
+    @commands.command()
+    @is_next()
+    async def rebuild_totals(self, ctx: Context):
+        """Rebuilds the users and channels leaderboards from the stats."""
+
+        await self.buffer.flush()
+        await self.build_totals()
+
+        await green_embed(ctx, 'Rebuilt the leaderboards!')
+
+    async def build_totals(self):
+        """Replaces the users and channels leaderboards with the totals aggregated from the stats.
+
+        The flushes wait for it, since $out would overwrite the increments written while it runs.
+        """
+
+        async with self.buffer.lock:
+            await self.retry_failed_writes()
+
+            for collection, key in ((self.user_totals, 'user_id'), (self.channel_totals, 'channel_id')):
+                # The reactions of unknown users are only counted in the channels leaderboards
+                stages = [{'$match': {'user_id': {'$ne': UNKNOWN_USER_ID}}}] if key == 'user_id' else []
+
+                await self.stats.aggregate([
+                    *stages,
                     {
                         '$group': {
-                            '_id': '$channel_id',
-                            'total': {'$sum': f'${stat}'},
+                            '_id': {'guild_id': '$guild_id', key: f'${key}'},
+                            **{stat: {'$sum': f'${stat}'} for stat in STATS}
+                        }
+                    },
+                    {
+                        '$project': {
+                            '_id': 0,
+                            'guild_id': '$_id.guild_id',
+                            key: f'$_id.{key}',
+                            **{stat: 1 for stat in STATS}
                         }
                     },
-                    {'$sort': {'total': -1}}
-                ])
+                    {'$out': collection.name}
+                ]).to_list(length=None)
 
-                data = await query.to_list(length=25)
+    async def send_weekly_stats(self, entry: dict, since: datetime):
+        """Sends the weekly leaderboards of a guild, aggregated all at once with a $facet."""
 
-                embed = Embed(
+        channel = self.bot.get_channel(entry['channel_id'])
+        if channel is None:
+            return
+
+        started_at = perf_counter()
+
+        facets = {
+            f'{group_by}_{stat}': [*self.leaderboard_stages(group_by, stat), {'$limit': 25}]
+            for stat in STATS
+            for group_by in ('channel_id', 'user_id')
+        }
+        query = self.stats_buckets.aggregate([self.range_match(entry['guild_id'], since), {'$facet': facets}])
+        leaderboards = (await query.to_list(length=1))[0]
+
+        for stat in STATS:
+            embeds = (
+                Embed(
                     title=f'Weekly Channels Leaderboard - {stat.title()}',
                     description='\n'.join(
-                        f'{i}. <#{entry["_id"]}> - **{entry["total"]:,}** {stat}'
-                        for i, entry in enumerate(data, 1)
+                        f'{i}. <#{e["channel_id"]}> - **{e[stat]:,}** {stat}'
+                        for i, e in enumerate(leaderboards[f'channel_id_{stat}'], 1)
+                    )
+                ),
+                Embed(
+                    title=f'Weekly Users Leaderboard - {stat.title()}',
+                    description='\n'.join(
+                        f'{i}. <@{e["user_id"]}> - **{e[stat]:,}** {stat}'
+                        for i, e in enumerate(leaderboards[f'user_id_{stat}'], 1)
                     )
                 )
+            )
 
+            for embed in embeds:
                 try:
                     await channel.send(embed=embed)
                 except discord.HTTPException:
                     log.warning(f'Couldn\'t send a weekly stats message in the {channel} channel!')
 
-                # Users
-                query = self.stats_weekly.aggregate([
-                    {'$match': {'guild_id': entry['guild_id']}},
-                    {
-                        '$group': {
-                            '_id': '$user_id',
-                            'total': {'$sum': f'${stat}'},
-                        }
-                    },
-                    {'$sort': {'total': -1}}
-                ])
+        log.info(f'Sent the weekly stats of the {channel.guild} guild in {perf_counter() - started_at:.2f}s')
 
-                data = await query.to_list(length=25)
+    @loop(time=time(hour=19, minute=0))
+    async def weekly_stats(self):
+        """Posts the weekly stats on Sundays 19 UTC."""
 
-                embed = Embed(
-                    title=f'Weekly Users Leaderboard - {stat.title()}',
-                    description='\n'.join(
-                        f'{i}. <@{entry["_id"]}> - **{entry["total"]:,}** {stat}'
-                        for i, entry in enumerate(data, 1)
-                    )
-                )
+        await self.bot.wait_until_ready()
+
+        now = discord.utils.utcnow()
+        if now.weekday() != 6:
+            return
 
+        week_ago = now - PERIODS['Week']
+        semaphore = Semaphore(STATS_WEEKLY_CONCURRENCY)
+
+        async def send(entry: dict):
+            async with semaphore:
                 try:
-                    await channel.send(embed=embed)
-                except discord.HTTPException:
-                    log.warning(f'Couldn\'t send a weekly stats message in the {channel} channel!')
+                    await self.send_weekly_stats(entry, week_ago)
+                except Exception as e:
+                    log.error(f'Couldn\'t send the weekly stats of the guild {entry["guild_id"]}: {e}')
 
-        await self.stats_weekly.delete_many({})
+        await gather(*[send(entry) async for entry in self.weekly_channels.find()])
 
 
 async def setup(bot: 'NextBot'):
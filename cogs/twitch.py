@@ -1,54 +1,166 @@
+from asyncio import gather, sleep, Lock, Semaphore
+from collections import defaultdict
 from datetime import datetime
+from logging import getLogger
 from os import getenv
 from random import random
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Iterable
 from urllib.parse import quote
 
 import discord
 from discord import app_commands, Interaction
 from discord.app_commands import command
-from discord.ext.commands import GroupCog
+from discord.ext import commands
+from discord.ext.commands import GroupCog, Context
 from discord.ext.tasks import loop
 from motor.core import AgnosticCollection
+from pymongo import IndexModel, UpdateOne, ASCENDING
+from pymongo.errors import PyMongoError
 
+from utils.cache import AsyncTTLCache
+from utils.checks import is_next
 from utils.embeds import *
+from utils.eventsub import EventSub, WebhookTransport, WebSocketTransport
+from utils.helix import HelixClient, HelixError
+from utils.indexes import QueryShape, ensure_indexes
+from utils.live_index import LiveIndex
+from utils.pagination import TokenPageSource
+from utils.poll_scheduler import PollScheduler
+from utils.views import PaginationView
 
 if TYPE_CHECKING:
     from nextbot import NextBot
 
-BASE_URL = 'https://api.twitch.tv/helix/'
+log = getLogger(__name__)
 
-HEADERS = {
-    'Client-ID': getenv('TWITCH_CLIENT_ID'),
-    'Authorization': f'Bearer {getenv("TWITCH_TOKEN")}'
-}
+# The maximum amount of user_login parameters in a streams request
+MAX_LOGINS = 100
+
+# The maximum amount of streams requests per minute made by the live checks
+TWITCH_POLL_BUDGET = float(getenv('TWITCH_POLL_BUDGET', 30))
+
+# The maximum amount of notifications being sent at once
+NOTIFICATIONS_CONCURRENCY = int(getenv('TWITCH_NOTIFICATIONS_CONCURRENCY', 10))
+
+# The users and games rarely change, the lookups of invalid ones are cached for a shorter time
+USERS_CACHE_TTL = 6 * 60 * 60
+GAMES_CACHE_TTL = 24 * 60 * 60
+NEGATIVE_CACHE_TTL = 10 * 60
+# The pages of the /twitch streams command, shared between the invocations
+STREAMS_PER_PAGE = 10
+STREAMS_CACHE_TTL = 60
+
+# 'webhook' or 'websocket' to receive the live notifications with EventSub, polling is used otherwise
+TWITCH_EVENTSUB = getenv('TWITCH_EVENTSUB')
+TWITCH_EVENTSUB_CALLBACK = getenv('TWITCH_EVENTSUB_CALLBACK')
+TWITCH_EVENTSUB_SECRET = getenv('TWITCH_EVENTSUB_SECRET')
+TWITCH_EVENTSUB_PORT = int(getenv('TWITCH_EVENTSUB_PORT', 8080))
+# While EventSub is connected, the polling intervals are n times longer, as a safety net for missed notifications
+TWITCH_EVENTSUB_POLL_EVERY = int(getenv('TWITCH_EVENTSUB_POLL_EVERY', 10))
 
 
 class Twitch(GroupCog, name='twitch'):
     bot: 'NextBot'
     twitch_notifs: AgnosticCollection
+    live_history: AgnosticCollection
+    live_index: LiveIndex
+    helix: HelixClient
+    eventsub: EventSub | None
+
+    indexes = {
+        'twitch_notifs': [IndexModel([('user_id', ASCENDING), ('twitch_user', ASCENDING)])],
+        'twitch_live_history': [IndexModel('twitch_user', unique=True)]
+    }
+    query_shapes = (QueryShape('twitch_notifs', {'user_id': 0, 'twitch_user': ''}),)
 
     def __init__(self, bot: 'NextBot'):
         self.bot = bot
         self.twitch_notifs = self.bot.db['twitch_notifs']
+        self.live_history = self.bot.db['twitch_live_history']
+        self.live_index = LiveIndex()
+        # The polls and the EventSub notifications would otherwise flip the same live statuses twice
+        self.live_status_lock = Lock()
+        self.scheduler = PollScheduler(TWITCH_POLL_BUDGET)
+        self.helix = HelixClient(
+            self.bot.session,
+            getenv('TWITCH_CLIENT_ID'),
+            getenv('TWITCH_CLIENT_SECRET'),
+            getenv('TWITCH_TOKEN')
+        )
+        self.users_cache = AsyncTTLCache(1000, USERS_CACHE_TTL, NEGATIVE_CACHE_TTL)
+        self.games_cache = AsyncTTLCache(500, GAMES_CACHE_TTL, NEGATIVE_CACHE_TTL)
+        self.streams_cache = AsyncTTLCache(200, STREAMS_CACHE_TTL)
+        self.eventsub = self.create_eventsub()
+        self.notifications_semaphore = Semaphore(NOTIFICATIONS_CONCURRENCY)
 
     async def cog_load(self):
-        """Starts the background task."""
+        """Creates the indexes, loads the subscriptions, subscribes to the EventSub notifications and starts the
+        background tasks."""
+
+        await ensure_indexes(self.bot.db, self.indexes)
+        await self.live_index.load(self.twitch_notifs)
+
+        async for entry in self.live_history.find({}):
+            starts = {int(hour): count for hour, count in entry['starts'].items()}
+            self.scheduler.load_history(entry['twitch_user'], starts)
+
+        if self.eventsub is not None:
+            try:
+                self.eventsub.broadcaster_ids = await self.fetch_broadcaster_ids()
+            except HelixError as e:
+                log.error(f'Failed to fetch the followed streamers, subscribing on the next reconciliation: {e}')
+
+            await self.eventsub.start(self.on_eventsub)
+            self.reconcile_eventsub.start()
 
         self.check_live.start()
 
-    async def fetch(self, endpoint: str, params: dict[str, str]) -> dict | None:
-        """Fetches data from the Twitch API."""
+    async def cog_unload(self):
+        """Stops the background tasks and the EventSub transport."""
+
+        self.check_live.cancel()
+
+        if self.eventsub is not None:
+            self.reconcile_eventsub.cancel()
+            await self.eventsub.stop()
+
+    def create_eventsub(self) -> EventSub | None:
+        """Creates the EventSub client with the transport set in TWITCH_EVENTSUB."""
+
+        if TWITCH_EVENTSUB == 'webhook':
+            transport = WebhookTransport(TWITCH_EVENTSUB_CALLBACK, TWITCH_EVENTSUB_SECRET, port=TWITCH_EVENTSUB_PORT)
+        elif TWITCH_EVENTSUB == 'websocket':
+            transport = WebSocketTransport(self.bot.session)
+        else:
+            return None
+
+        return EventSub(self.helix, transport)
+
+    async def fetch(
+        self,
+        endpoint: str,
+        params: dict[str, str] | list[tuple[str, str]],
+        cache: AsyncTTLCache = None,
+        key: str = None
+    ) -> dict | None:
+        """Fetches data from the Twitch API, through the cache if one is given. The errors aren't cached."""
+
+        async def fetch_data() -> dict | None:
+            return await self.helix.get_data(endpoint, params) or None
+
+        try:
+            if cache is not None:
+                return await cache.get(key, fetch_data)
 
-        async with self.bot.session.get(BASE_URL + endpoint, params=params, headers=HEADERS) as resp:
-            response = await resp.json()
-            if 'data' in response:
-                return response['data'] if response['data'] else None
+            return await fetch_data()
+        except HelixError as e:
+            log.error(f'Failed to fetch {endpoint}: {e}')
+            return None
 
     async def fetch_twitch_user(self, user: str) -> dict | None:
         """Fetches the Twitch user from the Twitch API."""
 
-        return await self.fetch('users', {'login': quote(user)})
+        return await self.fetch('users', {'login': quote(user)}, self.users_cache, user.lower())
 
     async def fetch_user_avatar(self, user: str) -> str | None:
         """Fetches the user's avatar url."""
@@ -61,18 +173,56 @@ class Twitch(GroupCog, name='twitch'):
 
         return await self.fetch('streams', {'user_login': quote(user)})
 
+    async def fetch_live_streams(self, users: Iterable[str]) -> dict[str, dict]:
+        """Fetches the streams of the live users, MAX_LOGINS users per request. Returns the streams by user login.
+
+        Raises HelixError if a request fails, so the users aren't mistaken for offline.
+        """
+
+        users = list(users)
+        chunks = [users[i:i + MAX_LOGINS] for i in range(0, len(users), MAX_LOGINS)]
+        responses = await gather(*(
+            self.helix.get_data('streams', [('first', str(MAX_LOGINS)), *(('user_login', user) for user in chunk)])
+            for chunk in chunks
+        ))
+
+        return {stream['user_login'].lower(): stream for streams in responses for stream in streams}
+
+    async def fetch_broadcaster_ids(self) -> set[str]:
+        """Fetches the Twitch user ids of the followed streamers, MAX_LOGINS users per request."""
+
+        users = self.live_index.streamers
+        chunks = [users[i:i + MAX_LOGINS] for i in range(0, len(users), MAX_LOGINS)]
+        responses = await gather(*(
+            self.helix.get_data('users', [('login', user) for user in chunk])
+            for chunk in chunks
+        ))
+
+        return {user['id'] for users in responses for user in users}
+
     async def fetch_game(self, game_name: str) -> dict | None:
         """Fetches the Game object from the Twitch API."""
 
-        return await self.fetch('games', {'name': quote(game_name)})
+        return await self.fetch('games', {'name': quote(game_name)}, self.games_cache, game_name.lower())
+
+    async def fetch_streams(self, game_id: str, cursor: str | None) -> tuple[list[dict], str | None]:
+        """Fetches a page of the game's streams starting at the cursor, returns them and the cursor of the next page.
+
+        The pages are cached by (game_id, cursor) for STREAMS_CACHE_TTL seconds.
+        """
+
+        async def fetch_page() -> tuple[list[dict], str | None]:
+            params = {'game_id': game_id, 'first': str(STREAMS_PER_PAGE)}
+            if cursor is not None:
+                params['after'] = cursor
 
-    async def fetch_streams(self, game_id: str) -> dict | None:
-        """Fetches the Stream object from the Twitch API."""
+            response = await self.helix.request('GET', 'streams', params=params)
+            return response.get('data', []), response.get('pagination', {}).get('cursor')
 
-        return await self.fetch('streams', {'game_id': game_id, 'first': '6'})
+        return await self.streams_cache.get((game_id, cursor), fetch_page)
 
-    async def send_notification(self, user: discord.User, message: str, where: str | dict, data: dict):
-        """Sends the notification."""
+    async def notification_embed(self, data: dict) -> discord.Embed:
+        """Creates the notification embed of the stream."""
 
         game_name = data['game_name']
         date = datetime.strptime(data['started_at'], '%Y-%m-%dT%H:%M:%SZ')
@@ -93,65 +243,201 @@ class Twitch(GroupCog, name='twitch'):
         embed.set_image(url=thumbnail_url.replace('{width}', '880').replace('{height}', '496') + cache_buster)
         embed.set_thumbnail(url=await self.fetch_user_avatar(name))
 
-        if where == 'dm':
-            if not user.dm_channel:
-                await user.create_dm()
+        return embed
 
-            await user.dm_channel.send(message, embed=embed)
-        else:
-            guild = self.bot.get_guild(where['guild_id'])
-            channel = guild.get_channel(where['channel_id'])
-            await channel.send(message, embed=embed)
+    async def send_notification(self, destination: discord.abc.Messageable, messages: list[str], embed: discord.Embed):
+        """Sends the notification, with the messages of all the subscribers of the destination combined."""
+
+        # The messages are split on the message length limit, the embed is only sent with the first part
+        contents = ['']
+        for message in dict.fromkeys(messages):
+            if contents[-1] and len(contents[-1]) + len(message) + 1 > 2000:
+                contents.append('')
+
+            contents[-1] = f'{contents[-1]}\n{message}' if contents[-1] else message
+
+        async with self.notifications_semaphore:
+            await destination.send(contents[0], embed=embed)
+            for content in contents[1:]:
+                await destination.send(content)
+
+    def notification_destination(self, subscriber: dict) -> discord.abc.Messageable | None:
+        """Returns the user or the channel the subscriber's notifications are sent to."""
+
+        if subscriber['where'] == 'dm':
+            return self.bot.get_user(subscriber['user_id'])
+
+        guild = self.bot.get_guild(subscriber['where']['guild_id'])
+        return guild.get_channel(subscriber['where']['channel_id']) if guild is not None else None
+
+    async def notify_subscribers(self, data: dict, subscribers: list[dict]):
+        """Sends the notifications of a stream, concurrently and grouped by destination.
+
+        The embed is built once, and the subscribers sending to the same channel share one message.
+        A failed send is logged without affecting the others.
+        """
+
+        embed = await self.notification_embed(data)
+
+        destinations: dict[discord.abc.Messageable, list[str]] = defaultdict(list)
+        for subscriber in subscribers:
+            user = self.bot.get_user(subscriber['user_id'])
+            destination = self.notification_destination(subscriber)
+            if user is None or destination is None:
+                log.warning(f'Couldn\'t find where to notify {subscriber["user_id"]} about {subscriber["twitch_user"]}')
+                continue
+
+            destinations[destination].append(subscriber['message'].replace('<mention>', user.mention))
+
+        results = await gather(
+            *(self.send_notification(destination, messages, embed) for destination, messages in destinations.items()),
+            return_exceptions=True
+        )
+        for destination, result in zip(destinations, results):
+            if isinstance(result, Exception):
+                log.error(f'Failed to send the {data["user_login"]} notification to {destination}: {result}')
+
+    async def write_live_status(self, live_streams: dict[str, dict], streamers: list[str] = None) -> list[dict] | None:
+        """Writes the live statuses that changed, in one bulk write, and updates the index once they are written.
+
+        Returns the changed subscriptions, or None if the write failed so that they are retried on the next check.
+        """
+
+        async with self.live_status_lock:
+            changed = self.live_index.diff(live_streams, streamers)
+            if not changed:
+                return changed
+
+            try:
+                await self.twitch_notifs.bulk_write(LiveIndex.flip_operations(changed), ordered=False)
+            except PyMongoError as e:
+                log.error(f'Failed to write the live statuses, retrying on the next check: {e}')
+                return None
+
+            LiveIndex.flip(changed)
+            return changed
 
     async def check_on_start(self):
         """Checks for live streamers on startup."""
 
-        users = self.twitch_notifs.find({})
+        try:
+            live_streams = await self.fetch_live_streams(self.live_index.streamers)
+        except HelixError as e:
+            return log.error(f'Failed to check the live statuses on startup: {e}')
 
-        async for user in users:
-            live_status = await self.fetch_live_status(user['twitch_user'])
-            if live_status is not None and not user['is_live']:
-                await self.twitch_notifs.update_one(
-                    {'user_id': user['user_id'], 'twitch_user': user['twitch_user']},
-                    {'$set': {'is_live': True}}
-                )
+        await self.write_live_status(live_streams)
 
-            elif live_status is None and user['is_live']:
-                await self.twitch_notifs.update_one(
-                    {'user_id': user['user_id'], 'twitch_user': user['twitch_user']},
-                    {'$set': {'is_live': False}}
-                )
+    def is_in_db(self, user_id: int, twitch_user: str) -> bool:
+        return self.live_index.get(user_id, twitch_user) is not None
 
-    async def is_in_db(self, user_id: int, twitch_user: str) -> bool:
-        return True if await self.twitch_notifs.find_one({'user_id': user_id, 'twitch_user': twitch_user}) else False
+    async def update_live_status(self, live_streams: dict[str, dict], streamers: list[str] = None):
+        """Notifies the users whose streamer went live and stores the new live statuses."""
 
-    @loop(seconds=60)
+        changed = await self.write_live_status(live_streams, streamers)
+        if not changed:
+            return
+
+        went_live: dict[str, list[dict]] = defaultdict(list)
+        for subscription in changed:
+            if subscription['is_live']:
+                went_live[subscription['twitch_user']].append(subscription)
+
+        for twitch_user in {subscription['twitch_user'] for subscription in changed}:
+            print(f'{twitch_user} went live!' if twitch_user in went_live else f'{twitch_user} stopped streaming.')
+
+        results = await gather(
+            *(
+                self.notify_subscribers(live_streams[twitch_user], subscribers)
+                for twitch_user, subscribers in went_live.items()
+            ),
+            return_exceptions=True
+        )
+        for twitch_user, result in zip(went_live, results):
+            if isinstance(result, Exception):
+                log.error(f'Failed to send the {twitch_user} notifications: {result}')
+
+    async def record_polls(self, streamers: list[str], live_streams: dict[str, dict]):
+        """Records the polled live statuses in the scheduler and stores the hours the streams started at."""
+
+        starts = self.scheduler.record(streamers, live_streams)
+        if not starts:
+            return
+
+        try:
+            await self.live_history.bulk_write([
+                UpdateOne({'twitch_user': twitch_user}, {'$inc': {f'starts.{hour}': 1}}, upsert=True)
+                for twitch_user, hour in starts
+            ], ordered=False)
+        except PyMongoError as e:
+            log.error(f'Failed to store the live history: {e}')
+
+    @loop(seconds=5)
     async def check_live(self):
-        """Checks for live streamers every 60 seconds."""
+        """Checks the live status of the streamers that are due, see PollScheduler.
+
+        While EventSub is connected, the intervals are TWITCH_EVENTSUB_POLL_EVERY times longer as it is only a fallback.
+        """
+
+        connected = self.eventsub is not None and self.eventsub.connected
+        self.scheduler.slowdown = TWITCH_EVENTSUB_POLL_EVERY if connected else 1
+        self.scheduler.sync(self.live_index.summary())
+
+        streamers = self.scheduler.due(MAX_LOGINS)
+        if not streamers:
+            return
+
+        try:
+            try:
+                live_streams = await self.fetch_live_streams(streamers)
+            except HelixError as e:
+                return log.error(f'Failed to check the live statuses, skipping this check: {e}')
+
+            await self.update_live_status(live_streams, streamers)
+            await self.record_polls(streamers, live_streams)
+        finally:
+            # The streamers are out of the schedule until then, whatever failed they have to be polled again
+            self.scheduler.postpone(streamers)
 
-        users = self.twitch_notifs.find({})
+    async def on_eventsub(self, subscription_type: str, event: dict):
+        """Handles the stream.online and stream.offline notifications."""
 
-        async for user in users:
-            live_status = await self.fetch_live_status(user['twitch_user'])
-            if live_status is not None and not user['is_live']:
-                user_to_notify = self.bot.get_user(user['user_id'])
-                message = user['message'].replace('<mention>', user_to_notify.mention)
+        twitch_user = event['broadcaster_user_login']
+        live_streams = {}
 
-                await self.send_notification(user_to_notify, message, user['where'], live_status[0])
+        if subscription_type == 'stream.online':
+            # The stream can take a few seconds to show up in the API after the notification
+            for _ in range(3):
+                try:
+                    live_streams = await self.fetch_live_streams([twitch_user])
+                except HelixError as e:
+                    log.error(f'Failed to fetch the stream of {twitch_user}: {e}')
 
-                await self.twitch_notifs.update_one(
-                    {'user_id': user['user_id'], 'twitch_user': user['twitch_user']},
-                    {'$set': {'is_live': True}}
-                )
+                if live_streams:
+                    break
 
-                print(f'{user["twitch_user"]} went live!')
-            elif live_status is None and user['is_live']:
-                await self.twitch_notifs.update_one(
-                    {'user_id': user['user_id'], 'twitch_user': user['twitch_user']},
-                    {'$set': {'is_live': False}}
-                )
+                await sleep(10)
+            else:
+                log.warning(f'{twitch_user} went live but the stream wasn\'t found, leaving it to the polling')
+                return
 
-                print(f'{user["twitch_user"]} stopped streaming.')
+        await self.update_live_status(live_streams, [twitch_user])
+        await self.record_polls([twitch_user], live_streams)
+
+    async def sync_eventsub(self):
+        """Makes the EventSub subscriptions match the followed streamers."""
+
+        try:
+            broadcaster_ids = await self.fetch_broadcaster_ids()
+        except HelixError as e:
+            return log.error(f'Failed to fetch the followed streamers, keeping the EventSub subscriptions: {e}')
+
+        await self.eventsub.reconcile(broadcaster_ids)
+
+    @loop(minutes=10)
+    async def reconcile_eventsub(self):
+        """Periodically makes the EventSub subscriptions match the followed streamers."""
+
+        await self.sync_eventsub()
 
     @check_live.before_loop
     async def before_check_live(self):
@@ -175,6 +461,9 @@ class Twitch(GroupCog, name='twitch'):
     ):
         """Sets up the notification."""
 
+        if self.is_in_db(interaction.user.id, twitch_user.lower()):
+            return await error_embed(interaction, f'You already have a notification setup for `{twitch_user}`!')
+
         if await self.fetch_twitch_user(twitch_user) is None:
             return await error_embed(interaction, 'Invalid Twitch user!')
 
@@ -190,8 +479,12 @@ class Twitch(GroupCog, name='twitch'):
         }
 
         await self.twitch_notifs.insert_one(notifs_entry)
+        self.live_index.add(notifs_entry)
         await success_embed(interaction, f'Successfully set your notification for `{twitch_user}`!')
 
+        if self.eventsub is not None:
+            await self.sync_eventsub()
+
     @command()
     @app_commands.describe(
         twitch_user='The Twitch username of the streamer you want to edit the notification for',
@@ -211,7 +504,7 @@ class Twitch(GroupCog, name='twitch'):
             return await error_embed(interaction, 'You can\'t leave both of the options empty!')
 
         twitch_user = twitch_user.lower()
-        if not await self.is_in_db(interaction.user.id, twitch_user):
+        if not self.is_in_db(interaction.user.id, twitch_user):
             return await error_embed(interaction, f'You don\'t have a notification setup for `{twitch_user}`!')
 
         set_query = {}
@@ -224,6 +517,7 @@ class Twitch(GroupCog, name='twitch'):
             {'user_id': interaction.user.id, 'twitch_user': twitch_user},
             {'$set': set_query}
         )
+        self.live_index.update(interaction.user.id, twitch_user, set_query)
 
         await success_embed(interaction, f'Successfully edited the notification!')
 
@@ -233,17 +527,21 @@ class Twitch(GroupCog, name='twitch'):
         """Removes a notification."""
 
         twitch_user = twitch_user.lower()
-        if not await self.is_in_db(interaction.user.id, twitch_user):
+        if not self.is_in_db(interaction.user.id, twitch_user):
             return await error_embed(interaction, f'You don\'t have a notification setup for `{twitch_user}`!')
 
         await self.twitch_notifs.delete_one({'user_id': interaction.user.id, 'twitch_user': twitch_user})
+        self.live_index.remove(interaction.user.id, twitch_user)
 
         await success_embed(interaction, 'Successfully removed the notification!')
 
+        if self.eventsub is not None:
+            await self.sync_eventsub()
+
     @command()
     @app_commands.describe(game='The game to show the streams')
     async def streams(self, interaction: Interaction, game: str):
-        """Shows the top 5 streams for a game."""
+        """Shows the top streams for a game."""
 
         game_info = await self.fetch_game(game)
         if not game_info:
@@ -253,29 +551,65 @@ class Twitch(GroupCog, name='twitch'):
         game_name = game_info['name']
         game_image_url = game_info['box_art_url'].replace('{width}', '432').replace('{height}', '576')
 
-        streams = await self.fetch_streams(game_info['id'])
-        if not streams:
+        source = TokenPageSource(lambda cursor: self.fetch_streams(game_info['id'], cursor), STREAMS_PER_PAGE)
+        view = PaginationView(
+            f'{game_name} streams',
+            source,
+            lambda d: (
+                f'[**{e["user_name"]}**](https://twitch.tv/{e["user_login"]}) - {e["viewer_count"]:,} viewers\n'
+                f'{e["title"]}'
+                for e in d
+            ),
+            interaction,
+            f'https://www.twitch.tv/directory/game/{quote(game_name)}\n\n',
+            game_image_url
+        )
+
+        try:
+            embed = await view.embed()
+        except HelixError as e:
+            log.error(f'Failed to fetch the {game_name} streams: {e}')
+            return await error_embed(interaction, 'Couldn\'t fetch the streams, try again later!')
+
+        if not await source.get_page(0):
             return await error_embed(interaction, f'No streams found for **{game_name}**')
 
-        embed = Embed()
-        embed.set_author(
-            name=f'{game_name} streams',
-            url=f'https://www.twitch.tv/directory/game/{game}',
-            icon_url=self.bot.user.avatar.url
+        await interaction.response.send_message(embed=embed, view=view)
+
+    @commands.command()
+    @is_next()
+    async def helix(self, ctx: Context):
+        """Shows the Helix client counters, the rate limit and the lookup caches hit rates."""
+
+        counters = '\n'.join(f'{name.replace("_", " ").capitalize()}: **{value:,}**' for name, value in sorted(
+            self.helix.counters.items()
+        ))
+        caches = '\n'.join(
+            f'{name} cache: **{cache.hit_rate:.1%}** hit rate, **{len(cache):,}** entries'
+            for name, cache in (('Users', self.users_cache), ('Games', self.games_cache))
+        )
+        await green_embed(
+            ctx,
+            f'{counters}\n\nRate limit: **{self.helix.bucket.remaining}/{self.helix.bucket.limit}** remaining\n\n'
+            f'{caches}'
         )
-        embed.set_image(url=game_image_url)
-
-        for stream in streams[:5]:
-            user_name = stream['user_name']
-            title = stream['title']
-            viewer_count = stream['viewer_count']
-            embed.add_field(
-                name=f'**{user_name}**',
-                value=f'{viewer_count} viewers -[**{title}**](https://twitch.tv/{user_name})',
-                inline=False
-            )
-
-        await interaction.response.send_message(embed=embed)
+
+
+    @commands.command()
+    @is_next()
+    async def polling(self, ctx: Context):
+        """Shows the polling interval and the notification latency of the most followed streamers."""
+
+        reports = sorted(self.scheduler.report(), key=lambda report: report.subscribers, reverse=True)[:20]
+        if not reports:
+            return await error_embed(ctx, 'No streamers are followed!')
+
+        lines = [
+            f'**{report.twitch_user}** ({report.subscribers} subs): every **{report.interval:.0f}s**, latency '
+            + (f'**{report.latency:.0f}s** ({report.samples} streams)' if report.latency is not None else 'unknown')
+            for report in reports
+        ]
+        await green_embed(ctx, '\n'.join(lines))
 
 
 async def setup(bot: 'NextBot'):
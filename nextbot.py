@@ -1,9 +1,10 @@
+from contextlib import suppress
 from os import getenv
 
 import discord
 from aiohttp import ClientSession
 from discord import Intents, Game, Emoji
-from discord.ext.commands import Bot
+from discord.ext.commands import Bot, ExtensionNotLoaded
 from discord.utils import get
 from dotenv import load_dotenv
 from motor.core import AgnosticDatabase
@@ -52,7 +53,11 @@ class NextBot(Bot):
             await self.load_extension(ext)
 
     async def close(self):
-        """Closes the aiohttp session and the bot."""
+        """Unloads the extensions, so they can clean up, and closes the aiohttp session and the bot."""
+
+        for ext in self.extensions:
+            with suppress(ExtensionNotLoaded):
+                await self.unload_extension(ext)
 
         await self.session.close()
         await super().close()
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+from time import monotonic
+
+import discord
+
+__all__ = ('BackfillProgress',)
+
+
+class BackfillProgress:
+    """Tracks the progress of a history backfill running over several channels at once.
+
+    Each channel's progress is measured by how far back in time the scan got, relative to the channel's age.
+    """
+
+    def __init__(self, channels: int):
+        self.channels = channels
+        self.channels_done = 0
+        self.messages = 0
+        self.started_at = monotonic()
+
+        self._spans: dict[int, tuple[datetime, float]] = {}
+        self._scanned: dict[int, float] = {}
+
+    def start_channel(self, channel: discord.abc.Messageable, newest: datetime, oldest: datetime):
+        """Registers a channel that is about to be scanned from the newest to the oldest date."""
+
+        self._spans[channel.id] = newest, max((newest - oldest).total_seconds(), 1)
+        self._scanned[channel.id] = 0
+
+    def advance(self, channel: discord.abc.Messageable, message: discord.Message):
+        """Registers a scanned message."""
+
+        self.messages += 1
+
+        newest, span = self._spans[channel.id]
+        self._scanned[channel.id] = min(max((newest - message.created_at).total_seconds(), 0), span)
+
+    def finish_channel(self, channel: discord.abc.Messageable):
+        """Registers a channel that has been fully scanned or skipped."""
+
+        self.channels_done += 1
+
+        if channel.id in self._spans:
+            self._scanned[channel.id] = self._spans[channel.id][1]
+
+    @property
+    def rate(self) -> float:
+        """The amount of messages scanned per second."""
+
+        return self.messages / max(monotonic() - self.started_at, 1)
+
+    @property
+    def fraction(self) -> float:
+        """The estimated fraction of the backfill that is done."""
+
+        pending_channels = self.channels - len(self._spans)
+        total = sum(span for _, span in self._spans.values())
+        scanned = sum(self._scanned.values())
+
+        # The channels that haven't been started yet are assumed to be as long as the average started channel
+        if self._spans:
+            total += pending_channels * total / len(self._spans)
+
+        return scanned / total if total else 0
+
+    @property
+    def eta(self) -> timedelta | None:
+        """The estimated remaining time."""
+
+        fraction = self.fraction
+        if not fraction:
+            return None
+
+        elapsed = monotonic() - self.started_at
+        return timedelta(seconds=int(elapsed * (1 - fraction) / fraction))
+
+    def describe(self) -> str:
+        """Describes the progress for the progress message."""
+
+        eta = self.eta
+        return (
+            f'Caching messages stats... **{self.fraction:.0%}**\n\n'
+            f'Channels: **{self.channels_done}/{self.channels}**\n'
+            f'Messages: **{self.messages:,}** ({self.rate:,.0f}/s)\n'
+            f'ETA: **{eta if eta is not None else "unknown"}**'
+        )
@@ -0,0 +1,116 @@
+from asyncio import CancelledError, Future, get_running_loop
+from collections import Counter, OrderedDict
+from time import monotonic
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+__all__ = ('AsyncTTLCache',)
+
+V = TypeVar('V')
+
+
+class AsyncTTLCache(Generic[V]):
+    """An LRU cache whose entries expire after a TTL, for the results of async lookups.
+
+    Concurrent misses for the same key share a single lookup. None results are cached too, for negative_ttl, so
+    lookups of things that don't exist aren't repeated. Exceptions aren't cached.
+    With a sizeof function, the cache is also bounded by the total size of the values, in max_bytes.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        negative_ttl: float | None = None,
+        max_bytes: int | None = None,
+        sizeof: Callable[[V], int] | None = None
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl if negative_ttl is not None else ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self.counters = Counter()
+        self.size_bytes = 0
+        self._entries: OrderedDict[Hashable, tuple[float, V | None, int]] = OrderedDict()
+        self._pending: dict[Hashable, Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of the lookups that didn't need a fetch, the coalesced ones included."""
+
+        saved = self.counters['hits'] + self.counters['coalesced']
+        lookups = saved + self.counters['misses']
+        return saved / lookups if lookups else 0
+
+    def get_cached(self, key: Hashable) -> tuple[bool, V | None]:
+        """Returns whether the key is cached and not expired, and its value."""
+
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+
+        expires_at, value, _ = entry
+        if expires_at <= monotonic():
+            self.invalidate(key)
+            return False, None
+
+        self._entries.move_to_end(key)
+        return True, value
+
+    def set(self, key: Hashable, value: V | None):
+        size = self.sizeof(value) if self.sizeof is not None and value is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        self.invalidate(key)
+
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._entries[key] = monotonic() + ttl, value, size
+        self.size_bytes += size
+
+        while len(self._entries) > self.max_size or (self.max_bytes is not None and self.size_bytes > self.max_bytes):
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+            self.counters['evictions'] += 1
+
+    def invalidate(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry[2]
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[V | None]]) -> V | None:
+        """Returns the cached value of the key, or fetches it if it isn't cached or has expired."""
+
+        cached, value = self.get_cached(key)
+        if cached:
+            self.counters['hits'] += 1
+            if value is None:
+                self.counters['negative_hits'] += 1
+            return value
+
+        if key in self._pending:
+            self.counters['coalesced'] += 1
+            return await self._pending[key]
+
+        self.counters['misses'] += 1
+        future = self._pending[key] = get_running_loop().create_future()
+        try:
+            value = await fetch()
+        except CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Retrieve the exception, so it isn't reported as never retrieved when nobody else waits for it
+            future.exception()
+            raise
+        else:
+            self.set(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            del self._pending[key]
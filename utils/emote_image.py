@@ -0,0 +1,69 @@
+from io import BytesIO
+
+from PIL import Image, ImageSequence
+
+__all__ = ('MAX_EMOJI_BYTES', 'MAX_EMOJI_SIZE', 'fit_emote')
+
+# Discord rejects emojis larger than 256 KiB, and displays them at 128px at most
+MAX_EMOJI_BYTES = 256 * 1024
+MAX_EMOJI_SIZE = 128
+
+
+def _encode(image: Image.Image, size: int, colors: int | None) -> bytes:
+    """Encodes the image as a PNG, or a GIF if it is animated, scaled to fit in size x size."""
+
+    buffer = BytesIO()
+
+    if getattr(image, 'is_animated', False):
+        frames = []
+        for frame in ImageSequence.Iterator(image):
+            frame = frame.convert('RGBA')
+            frame.thumbnail((size, size), Image.LANCZOS)
+            frames.append(frame)
+
+        frames[0].save(
+            buffer,
+            'GIF',
+            save_all=True,
+            append_images=frames[1:],
+            loop=0,
+            duration=image.info.get('duration', 100),
+            disposal=2,
+            optimize=True
+        )
+        return buffer.getvalue()
+
+    frame = image.convert('RGBA')
+    frame.thumbnail((size, size), Image.LANCZOS)
+    if colors is not None:
+        frame = frame.quantize(colors, method=Image.Quantize.FASTOCTREE)
+
+    frame.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def fit_emote(data: bytes, max_bytes: int = MAX_EMOJI_BYTES) -> bytes:
+    """Resizes and recompresses the image until it fits in max_bytes, images that already fit are returned as is.
+
+    It is CPU bound, so it should be run in a process pool.
+    Raises ValueError if the image can't be made small enough.
+    """
+
+    if len(data) <= max_bytes:
+        return data
+
+    with Image.open(BytesIO(data)) as image:
+        size = min(max(image.size), MAX_EMOJI_SIZE)
+        # Scales down first, then also reduces the colors, then keeps scaling down
+        for colors in (None, 256, 64):
+            encoded = _encode(image, size, colors)
+            if len(encoded) <= max_bytes:
+                return encoded
+
+        while size > 16:
+            size //= 2
+            encoded = _encode(image, size, 64)
+            if len(encoded) <= max_bytes:
+                return encoded
+
+    raise ValueError(f'The image could not be compressed under {max_bytes} bytes')
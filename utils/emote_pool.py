@@ -0,0 +1,64 @@
+from asyncio import Lock
+from collections import OrderedDict
+
+__all__ = ('EmotePool',)
+
+
+class EmotePool:
+    """A few emoji slots reserved in each guild for the emotes used in reactions, so they are reused between reactions.
+
+    The slots are keyed by the emote, usually its image url, and replaced in least recently used order once all of
+    a guild's slots are taken. Changes to a guild's slots should be made under its lock.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+
+        self._guilds: dict[int, OrderedDict[str, int]] = {}
+        self._locks: dict[int, Lock] = {}
+
+    def __contains__(self, guild_id: int) -> bool:
+        return guild_id in self._guilds
+
+    def lock(self, guild_id: int) -> Lock:
+        return self._locks.setdefault(guild_id, Lock())
+
+    def adopt(self, guild_id: int, slots: list[tuple[str, int]]):
+        """Takes the guild's slots stored before a restart, as (key, emoji id) pairs. They are replaced first."""
+
+        guild_slots = self._guilds.setdefault(guild_id, OrderedDict())
+        for key, emoji_id in reversed(slots):
+            guild_slots[key] = emoji_id
+            guild_slots.move_to_end(key, last=False)
+
+    def get(self, guild_id: int, key: str) -> int | None:
+        """Returns the emoji id of the emote's slot and marks it as recently used, or None if it has no slot."""
+
+        slots = self._guilds.get(guild_id, {})
+        emoji_id = slots.get(key)
+        if emoji_id is not None:
+            slots.move_to_end(key)
+
+        return emoji_id
+
+    def is_full(self, guild_id: int) -> bool:
+        return len(self._guilds.get(guild_id, {})) >= self.slots
+
+    def least_recently_used(self, guild_id: int) -> tuple[str, int] | None:
+        """Returns the key and the emoji id of the slot to replace, or None if the guild has no slots."""
+
+        slots = self._guilds.get(guild_id)
+        return next(iter(slots.items()), None) if slots else None
+
+    def add(self, guild_id: int, key: str, emoji_id: int):
+        self._guilds.setdefault(guild_id, OrderedDict())[key] = emoji_id
+
+    def remove(self, guild_id: int, key: str):
+        self._guilds.get(guild_id, {}).pop(key, None)
+
+    def discard_emojis(self, guild_id: int, emoji_ids: set[int]):
+        """Frees the slots whose emojis are no longer in the guild."""
+
+        slots = self._guilds.get(guild_id, {})
+        for key in [key for key, emoji_id in slots.items() if emoji_id not in emoji_ids]:
+            del slots[key]
@@ -0,0 +1,363 @@
+import hashlib
+import hmac
+import json
+from abc import ABC, abstractmethod
+from asyncio import create_task, sleep, Task
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Coroutine
+
+from aiohttp import ClientSession, ClientWebSocketResponse, WSMsgType, web
+
+from utils.helix import HelixClient, HelixError
+
+log = getLogger(__name__)
+
+__all__ = (
+    'SUBSCRIPTION_TYPES',
+    'EventSubTransport',
+    'WebhookTransport',
+    'WebSocketTransport',
+    'EventSub'
+)
+
+SUBSCRIPTION_TYPES = ('stream.online', 'stream.offline')
+# Notifications older than that are rejected, to prevent replay attacks
+MAX_MESSAGE_AGE = timedelta(minutes=10)
+
+EventHandler = Callable[[str, dict], Awaitable[None]]
+ConnectHandler = Callable[[], Awaitable[None]]
+
+
+class EventSubTransport(ABC):
+    """Receives the EventSub notifications and passes them to the event handler."""
+
+    def __init__(self):
+        self.on_event: EventHandler | None = None
+        self.on_connect: ConnectHandler | None = None
+        self._seen_messages: OrderedDict[str, None] = OrderedDict()
+        # The running handlers, referenced so they aren't garbage collected before they finish
+        self._tasks: set[Task] = set()
+
+    @property
+    @abstractmethod
+    def connected(self) -> bool:
+        """Whether notifications are currently being received."""
+
+    @abstractmethod
+    def payload(self) -> dict:
+        """The transport object sent when creating a subscription."""
+
+    @abstractmethod
+    def matches(self, transport: dict) -> bool:
+        """Whether an existing subscription's transport delivers to this transport."""
+
+    @abstractmethod
+    async def _start(self):
+        """Starts receiving notifications."""
+
+    @abstractmethod
+    async def stop(self):
+        """Stops receiving notifications."""
+
+    async def start(self, on_event: EventHandler, on_connect: ConnectHandler):
+        """Starts receiving notifications, on_connect is called every time the subscriptions need to be created."""
+
+        self.on_event = on_event
+        self.on_connect = on_connect
+        await self._start()
+
+    def is_duplicate(self, message_id: str) -> bool:
+        """Checks if the message has already been handled, as Twitch may deliver a notification more than once."""
+
+        if message_id in self._seen_messages:
+            return True
+
+        self._seen_messages[message_id] = None
+        if len(self._seen_messages) > 1000:
+            self._seen_messages.popitem(last=False)
+
+        return False
+
+    def run_in_background(self, coroutine: Coroutine[Any, Any, None]):
+        """Runs a handler in a task that is kept until it finishes, its exceptions are logged."""
+
+        task = create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f'EventSub handler failed: {task.exception()!r}')
+
+    def dispatch(self, subscription_type: str, event: dict):
+        """Runs the event handler in the background, so the notification can be acknowledged right away."""
+
+        self.run_in_background(self.on_event(subscription_type, event))
+
+
+class WebhookTransport(EventSubTransport):
+    """Receives the notifications with an aiohttp server, Twitch has to be able to reach callback_url over HTTPS."""
+
+    def __init__(
+        self,
+        callback_url: str,
+        secret: str,
+        host: str = '0.0.0.0',
+        port: int = 8080,
+        path: str = '/eventsub'
+    ):
+        super().__init__()
+
+        self.callback_url = callback_url
+        self.secret = secret.encode()
+        self.host = host
+        self.port = port
+        self.path = path
+
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self._runner is not None
+
+    def payload(self) -> dict:
+        return {'method': 'webhook', 'callback': self.callback_url, 'secret': self.secret.decode()}
+
+    def matches(self, transport: dict) -> bool:
+        return transport.get('method') == 'webhook' and transport.get('callback') == self.callback_url
+
+    async def _start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        log.info(f'Listening for EventSub notifications on {self.host}:{self.port}{self.path}')
+        await self.on_connect()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def verify(self, message_id: str, timestamp: str, body: bytes, signature: str) -> bool:
+        """Verifies the HMAC signature and the age of the message."""
+
+        digest = hmac.new(self.secret, message_id.encode() + timestamp.encode() + body, hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(f'sha256={digest}', signature):
+            return False
+
+        try:
+            # The timestamps have nanoseconds, which strptime can't parse
+            sent_at = datetime.strptime(timestamp[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+        except ValueError:
+            return False
+
+        return datetime.now(timezone.utc) - sent_at <= MAX_MESSAGE_AGE
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        message_id = request.headers.get('Twitch-Eventsub-Message-Id', '')
+        timestamp = request.headers.get('Twitch-Eventsub-Message-Timestamp', '')
+        signature = request.headers.get('Twitch-Eventsub-Message-Signature', '')
+
+        if not self.verify(message_id, timestamp, body, signature):
+            log.warning('Rejected an EventSub message with an invalid signature')
+            return web.Response(status=403)
+
+        data = json.loads(body)
+        message_type = request.headers.get('Twitch-Eventsub-Message-Type')
+
+        if message_type == 'webhook_callback_verification':
+            return web.Response(text=data['challenge'], content_type='text/plain')
+
+        if message_type == 'revocation':
+            subscription = data['subscription']
+            log.warning(f'EventSub subscription {subscription["type"]} was revoked: {subscription["status"]}')
+        elif message_type == 'notification' and not self.is_duplicate(message_id):
+            self.dispatch(data['subscription']['type'], data['event'])
+
+        return web.Response(status=204)
+
+
+class WebSocketTransport(EventSubTransport):
+    """Receives the notifications over a websocket. The subscriptions have to be created with a user access token."""
+
+    def __init__(self, session: ClientSession, url: str = 'wss://eventsub.wss.twitch.tv/ws', retry_delay: float = 5):
+        super().__init__()
+
+        self.session = session
+        self.url = url
+        self.retry_delay = retry_delay
+
+        self.session_id: str | None = None
+        self._ws: ClientWebSocketResponse | None = None
+        self._task: Task | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self.session_id is not None and self._ws is not None and not self._ws.closed
+
+    def payload(self) -> dict:
+        return {'method': 'websocket', 'session_id': self.session_id}
+
+    def matches(self, transport: dict) -> bool:
+        return transport.get('method') == 'websocket' and transport.get('session_id') == self.session_id
+
+    async def _start(self):
+        self._task = create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self._ws is not None:
+            await self._ws.close()
+
+        self.session_id = None
+
+    async def run(self):
+        """Keeps the websocket connected, reconnecting after errors and when Twitch asks to."""
+
+        url = self.url
+        while True:
+            try:
+                url = await self.receive(url)
+            except Exception as e:
+                log.error(f'EventSub websocket error, reconnecting in {self.retry_delay}s: {e}')
+                self.session_id = None
+                url = self.url
+                await sleep(self.retry_delay)
+
+    async def receive(self, url: str) -> str:
+        """Receives the messages of one connection. Returns the url to reconnect to."""
+
+        reconnecting = url != self.url
+        keepalive = 10
+
+        async with self.session.ws_connect(url) as ws:
+            self._ws = ws
+            while True:
+                message = await ws.receive(timeout=keepalive + 10)
+                if message.type in (WSMsgType.CLOSE, WSMsgType.CLOSED, WSMsgType.ERROR):
+                    raise ConnectionError(f'the websocket was closed ({ws.close_code})')
+
+                data = json.loads(message.data)
+                metadata = data['metadata']
+                payload = data['payload']
+
+                match metadata['message_type']:
+                    case 'session_welcome':
+                        self.session_id = payload['session']['id']
+                        keepalive = payload['session']['keepalive_timeout_seconds'] or keepalive
+
+                        # The subscriptions are carried over to the new connection after a reconnect message
+                        if not reconnecting:
+                            self.run_in_background(self.on_connect())
+                    case 'session_reconnect':
+                        return payload['session']['reconnect_url']
+                    case 'notification':
+                        if not self.is_duplicate(metadata['message_id']):
+                            self.dispatch(payload['subscription']['type'], payload['event'])
+                    case 'revocation':
+                        subscription = payload['subscription']
+                        log.warning(
+                            f'EventSub subscription {subscription["type"]} was revoked: {subscription["status"]}'
+                        )
+
+
+class EventSub:
+    """Manages the stream.online and stream.offline subscriptions of the followed broadcasters."""
+
+    def __init__(self, helix: HelixClient, transport: EventSubTransport):
+        self.helix = helix
+        self.transport = transport
+
+        # None until the followed broadcasters are known, so that the subscriptions aren't all deleted before that
+        self.broadcaster_ids: set[str] | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self.transport.connected
+
+    async def start(self, on_event: EventHandler):
+        await self.transport.start(on_event, self.on_connect)
+
+    async def stop(self):
+        await self.transport.stop()
+
+    async def on_connect(self):
+        if self.broadcaster_ids is not None:
+            await self.reconcile(self.broadcaster_ids)
+
+    async def request(self, method: str, endpoint: str, **kwargs) -> dict | None:
+        """Sends a request to the EventSub API, errors are logged."""
+
+        try:
+            return await self.helix.request(method, endpoint, **kwargs)
+        except HelixError as e:
+            log.error(f'EventSub {method} {endpoint} failed: {e}')
+            return None
+
+    async def list_subscriptions(self) -> list[dict]:
+        """Lists all the subscriptions of the application."""
+
+        subscriptions = []
+        params = {}
+        while True:
+            response = await self.request('GET', 'eventsub/subscriptions', params=params)
+            if response is None:
+                return subscriptions
+
+            subscriptions.extend(response['data'])
+
+            cursor = response.get('pagination', {}).get('cursor')
+            if not cursor:
+                return subscriptions
+
+            params = {'after': cursor}
+
+    async def subscribe(self, subscription_type: str, broadcaster_id: str):
+        await self.request('POST', 'eventsub/subscriptions', json={
+            'type': subscription_type,
+            'version': '1',
+            'condition': {'broadcaster_user_id': broadcaster_id},
+            'transport': self.transport.payload()
+        })
+
+    async def unsubscribe(self, subscription_id: str):
+        await self.request('DELETE', 'eventsub/subscriptions', params={'id': subscription_id})
+
+    async def reconcile(self, broadcaster_ids: set[str]):
+        """Makes the subscriptions match the broadcasters.
+
+        Missing subscriptions are created, and the ones for other broadcasters or transports, or that were revoked,
+        are deleted.
+        """
+
+        self.broadcaster_ids = set(broadcaster_ids)
+        if not self.connected:
+            return
+
+        wanted = {(sub_type, user_id) for sub_type in SUBSCRIPTION_TYPES for user_id in broadcaster_ids}
+        existing = set()
+
+        for subscription in await self.list_subscriptions():
+            key = subscription['type'], subscription['condition'].get('broadcaster_user_id')
+            active = subscription['status'] in ('enabled', 'webhook_callback_verification_pending')
+
+            if key in wanted and key not in existing and active and self.transport.matches(subscription['transport']):
+                existing.add(key)
+            else:
+                await self.unsubscribe(subscription['id'])
+
+        for subscription_type, user_id in wanted - existing:
+            await self.subscribe(subscription_type, user_id)
+
+        log.info(f'Reconciled the EventSub subscriptions: {len(wanted - existing)} created, {len(existing)} kept')
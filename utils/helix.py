@@ -0,0 +1,201 @@
+from asyncio import Lock, TimeoutError, sleep
+from collections import Counter
+from logging import getLogger
+from random import uniform
+from time import time
+
+from aiohttp import ClientError, ClientSession
+
+log = getLogger(__name__)
+
+__all__ = ('HelixError', 'RateLimitBucket', 'HelixClient')
+
+BASE_URL = 'https://api.twitch.tv/helix/'
+TOKEN_URL = 'https://id.twitch.tv/oauth2/token'
+
+
+class HelixError(Exception):
+    """A Helix request failed, after the retries if the error was retryable."""
+
+    def __init__(self, status: int | None, message: str):
+        super().__init__(f'{status}: {message}' if status is not None else message)
+        self.status = status
+
+
+class RateLimitBucket:
+    """A token bucket mirroring the Helix one, corrected with the Ratelimit headers of every response."""
+
+    def __init__(self, limit: int = 800, period: float = 60):
+        self.limit = limit
+        self.period = period
+        self.remaining = limit
+        self.reset_at = time() + period
+
+    async def acquire(self) -> bool:
+        """Takes a token, waiting for the bucket to be refilled if it is empty. Returns whether it had to wait."""
+
+        throttled = False
+        while True:
+            now = time()
+            if now >= self.reset_at:
+                self.remaining = self.limit
+                self.reset_at = now + self.period
+
+            if self.remaining > 0:
+                self.remaining -= 1
+                return throttled
+
+            throttled = True
+            await sleep(self.reset_at - now)
+
+    def update(self, headers: dict[str, str]):
+        """Updates the bucket with the Ratelimit-Limit, Ratelimit-Remaining and Ratelimit-Reset headers."""
+
+        try:
+            if 'Ratelimit-Limit' in headers:
+                self.limit = int(headers['Ratelimit-Limit'])
+            if 'Ratelimit-Remaining' in headers:
+                self.remaining = int(headers['Ratelimit-Remaining'])
+            if 'Ratelimit-Reset' in headers:
+                self.reset_at = int(headers['Ratelimit-Reset'])
+        except ValueError:
+            pass
+
+
+class HelixClient:
+    """Sends the Helix requests within the rate limit, retrying the ones that failed because of it or of the server.
+
+    With a client secret, the app access token is fetched with the client credentials flow and refreshed when it
+    expires or gets rejected. Otherwise the static token is used.
+    """
+
+    def __init__(
+        self,
+        session: ClientSession,
+        client_id: str,
+        client_secret: str | None = None,
+        token: str | None = None,
+        base_url: str = BASE_URL,
+        max_retries: int = 3,
+        backoff: float = 1
+    ):
+        self.session = session
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self.bucket = RateLimitBucket()
+        self.counters = Counter()
+
+        self._token = token
+        self._token_expires_at = None
+        self._token_lock = Lock()
+
+    async def refresh_token(self):
+        """Fetches a new app access token. Raises HelixError if it fails."""
+
+        try:
+            async with self.session.post(TOKEN_URL, params={
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'grant_type': 'client_credentials'
+            }) as resp:
+                if resp.status != 200:
+                    raise HelixError(resp.status, f'failed to get an app access token: {await resp.text()}')
+
+                data = await resp.json()
+        except (ClientError, TimeoutError) as e:
+            raise HelixError(None, f'failed to get an app access token: {str(e) or type(e).__name__}')
+
+        self._token = data['access_token']
+        self._token_expires_at = time() + data['expires_in']
+        self.counters['token_refreshes'] += 1
+
+    async def get_token(self) -> str:
+        """Returns the access token, refreshing it if it expires within a minute."""
+
+        if self.client_secret is None:
+            return self._token
+
+        async with self._token_lock:
+            if self._token is None or self._token_expires_at is None or self._token_expires_at - 60 < time():
+                await self.refresh_token()
+
+        return self._token
+
+    def retry_delay(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+
+        return uniform(0, self.backoff * 2 ** attempt)
+
+    async def request(self, method: str, endpoint: str, **kwargs) -> dict:
+        """Sends a request and returns the JSON response.
+
+        Rate limited and server errors are retried up to max_retries times, and a rejected token is refreshed once.
+        Raises HelixError if the request still fails.
+        """
+
+        token_refreshed = False
+        attempt = 0
+        while True:
+            if await self.bucket.acquire():
+                self.counters['throttled'] += 1
+
+            error = None
+            try:
+                token = await self.get_token()
+            except HelixError as e:
+                # Network and server errors while refreshing the token are retried like the request's
+                if e.status is not None and e.status < 500:
+                    self.counters['errors'] += 1
+                    raise
+
+                error = e
+
+            if error is None:
+                headers = {'Client-ID': self.client_id, 'Authorization': f'Bearer {token}'}
+                self.counters['requests'] += 1
+
+                try:
+                    async with self.session.request(
+                        method,
+                        self.base_url + endpoint,
+                        headers=headers,
+                        **kwargs
+                    ) as resp:
+                        self.bucket.update(resp.headers)
+
+                        if resp.status == 401 and self.client_secret is not None and not token_refreshed:
+                            token_refreshed = True
+                            self._token = None
+                            continue
+
+                        if resp.status < 400:
+                            return await resp.json() if resp.status != 204 else {}
+
+                        error = HelixError(resp.status, await resp.text())
+                        if resp.status != 429 and resp.status < 500:
+                            self.counters['errors'] += 1
+                            raise error
+
+                        if resp.status == 429:
+                            self.counters['rate_limited'] += 1
+                except (ClientError, TimeoutError) as e:
+                    error = HelixError(None, str(e) or type(e).__name__)
+
+            if attempt >= self.max_retries:
+                self.counters['errors'] += 1
+                raise error
+
+            self.counters['retries'] += 1
+            log.warning(f'Helix {method} {endpoint} failed ({error}), retrying')
+            await sleep(self.retry_delay(attempt))
+            attempt += 1
+
+    async def get_data(self, endpoint: str, params: dict[str, str] | list[tuple[str, str]]) -> list[dict]:
+        """Sends a GET request and returns the data of the response."""
+
+        response = await self.request('GET', endpoint, params=params)
+        return response.get('data', [])
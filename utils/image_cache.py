@@ -0,0 +1,137 @@
+import hashlib
+import os
+from collections import OrderedDict
+from io import BufferedReader
+from tempfile import NamedTemporaryFile
+from threading import Lock
+
+__all__ = ('ImageCache',)
+
+
+class ImageCache:
+    """A content-addressed cache of downloaded images on disk, bounded by max_bytes with LRU eviction.
+
+    The files are named after the SHA-256 of their url, and the recency is kept in the modification times, so the
+    LRU order survives restarts. The methods do blocking I/O, so they should be run in a thread, the index is
+    guarded by a lock.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self.size_bytes = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        # Spread over 256 subdirectories, so that the directories stay small
+        return os.path.join(self.directory, key[:2], key)
+
+    def load(self):
+        """Indexes the cached files, least recently used first, and evicts the ones over the size cap."""
+
+        files = []
+        os.makedirs(self.directory, exist_ok=True)
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+
+            for entry in os.scandir(subdirectory.path):
+                if entry.name.endswith('.tmp'):
+                    # Left over by an interrupted write
+                    os.remove(entry.path)
+                    continue
+
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+            for _, key, size in sorted(files):
+                self._entries[key] = size
+                self.size_bytes += size
+
+            self._evict()
+
+    def _evict(self):
+        """Removes the least recently used entries over the size cap, the lock has to be held."""
+
+        while self.size_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.size_bytes -= size
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def _touch(self, key: str) -> bool:
+        """Marks the entry as recently used, returns False if its file is gone. The lock has to be held."""
+
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            self.size_bytes -= self._entries.pop(key, 0)
+            return False
+
+        self._entries.move_to_end(key)
+        return True
+
+    def open(self, url: str) -> BufferedReader | None:
+        """Opens the cached image of the url and marks it as recently used, or returns None if it isn't cached.
+
+        The file is opened under the lock, so it stays readable even if the entry gets evicted right after.
+        """
+
+        key = self.key(url)
+        with self._lock:
+            if key not in self._entries or not self._touch(key):
+                return None
+
+            try:
+                return open(self.path(key), 'rb')
+            except FileNotFoundError:
+                self.size_bytes -= self._entries.pop(key, 0)
+                return None
+
+    def read(self, url: str) -> bytes | None:
+        """Reads the cached image of the url, or returns None if it isn't cached."""
+
+        file = self.open(url)
+        if file is None:
+            return None
+
+        with file:
+            return file.read()
+
+    def put(self, url: str, data: bytes):
+        """Stores the image of the url, evicting the least recently used ones over the size cap.
+
+        Images larger than the whole cache aren't stored.
+        """
+
+        if len(data) > self.max_bytes:
+            return
+
+        key = self.key(url)
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Written to a temporary file and renamed, so a file is never read while it is partially written
+        with NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as file:
+            file.write(data)
+
+        with self._lock:
+            os.replace(file.name, path)
+
+            self.size_bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
@@ -0,0 +1,79 @@
+from logging import getLogger
+from typing import NamedTuple
+
+from motor.core import AgnosticCollection, AgnosticDatabase
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+log = getLogger(__name__)
+
+__all__ = ('QueryShape', 'QueryPlan', 'ensure_indexes', 'explain_query')
+
+
+class QueryShape(NamedTuple):
+    """A query run by a cog, the values of the filter only need to have the right types."""
+
+    collection: str
+    filter: dict
+    sort: list[tuple[str, int]] | None = None
+
+
+class QueryPlan(NamedTuple):
+    stages: list[str]
+    docs_examined: int
+    keys_examined: int
+    returned: int
+
+    @property
+    def scanning(self) -> bool:
+        return 'COLLSCAN' in self.stages
+
+    @property
+    def covered(self) -> bool:
+        return 'IXSCAN' in self.stages and 'FETCH' not in self.stages
+
+
+async def ensure_indexes(db: AgnosticDatabase, indexes: dict[str, list[IndexModel]]):
+    """Creates the indexes for the collections. Indexes that already exist are left untouched."""
+
+    for collection_name, models in indexes.items():
+        try:
+            await db[collection_name].create_indexes(models)
+        except OperationFailure as e:
+            log.error(f'Couldn\'t create the indexes of the {collection_name} collection: {e}')
+
+
+def _plan_stages(plan: dict) -> list[str]:
+    """Lists the stages of a query plan, from the last to the first one."""
+
+    stages = [plan['stage']] if 'stage' in plan else []
+
+    if 'inputStage' in plan:
+        stages += _plan_stages(plan['inputStage'])
+
+    for input_stage in plan.get('inputStages', ()):
+        stages += _plan_stages(input_stage)
+
+    return stages
+
+
+async def explain_query(collection: AgnosticCollection, shape: QueryShape) -> QueryPlan:
+    """Runs explain() on the query shape and summarizes the winning plan."""
+
+    cursor = collection.find(shape.filter)
+    if shape.sort is not None:
+        cursor = cursor.sort(shape.sort)
+
+    explanation = await cursor.explain()
+
+    winning_plan = explanation['queryPlanner']['winningPlan']
+    # The slot based engine nests the classic plan under queryPlan
+    winning_plan = winning_plan.get('queryPlan', winning_plan)
+    execution_stats = explanation.get('executionStats', {})
+
+    return QueryPlan(
+        stages=_plan_stages(winning_plan),
+        docs_examined=execution_stats.get('totalDocsExamined', 0),
+        keys_examined=execution_stats.get('totalKeysExamined', 0),
+        returned=execution_stats.get('nReturned', 0)
+    )
@@ -0,0 +1,97 @@
+from typing import Iterable, Iterator, Mapping
+
+from motor.core import AgnosticCollection
+from pymongo import UpdateOne
+
+__all__ = ('LiveIndex',)
+
+
+class LiveIndex:
+    """The Twitch notification subscriptions and their live statuses, kept in memory and keyed by streamer.
+
+    It is loaded once and then kept in sync with the collection by the commands, so the live checks don't need to
+    read the database.
+    """
+
+    def __init__(self):
+        self._streamers: dict[str, dict[int, dict]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._streamers.values())
+
+    async def load(self, collection: AgnosticCollection):
+        """Loads all the subscriptions from the collection."""
+
+        self._streamers.clear()
+        async for subscription in collection.find({}, {'_id': 0}):
+            self.add(subscription)
+
+    @property
+    def streamers(self) -> list[str]:
+        return list(self._streamers)
+
+    def add(self, subscription: dict):
+        self._streamers.setdefault(subscription['twitch_user'], {})[subscription['user_id']] = subscription
+
+    def get(self, user_id: int, twitch_user: str) -> dict | None:
+        return self._streamers.get(twitch_user, {}).get(user_id)
+
+    def update(self, user_id: int, twitch_user: str, fields: dict):
+        self._streamers[twitch_user][user_id].update(fields)
+
+    def remove(self, user_id: int, twitch_user: str):
+        subscriptions = self._streamers.get(twitch_user, {})
+        subscriptions.pop(user_id, None)
+        if not subscriptions:
+            self._streamers.pop(twitch_user, None)
+
+    def subscribers(self, twitch_user: str) -> list[dict]:
+        return list(self._streamers.get(twitch_user, {}).values())
+
+    def summary(self) -> dict[str, tuple[int, bool]]:
+        """Returns the amount of subscribers and the live status of every streamer."""
+
+        return {
+            twitch_user: (len(subscriptions), any(subscription['is_live'] for subscription in subscriptions.values()))
+            for twitch_user, subscriptions in self._streamers.items()
+        }
+
+    def subscriptions(self) -> Iterator[dict]:
+        for subscriptions in self._streamers.values():
+            yield from subscriptions.values()
+
+    def diff(self, live_streams: Mapping[str, dict], streamers: Iterable[str] = None) -> list[dict]:
+        """Returns the subscriptions of the streamers whose live status differs from the live streams.
+
+        All the streamers are checked if none are given.
+        """
+
+        changed = []
+        for twitch_user in streamers if streamers is not None else self.streamers:
+            is_live = twitch_user in live_streams
+            changed.extend(
+                subscription
+                for subscription in self._streamers.get(twitch_user, {}).values()
+                if subscription['is_live'] != is_live
+            )
+
+        return changed
+
+    @staticmethod
+    def flip_operations(subscriptions: list[dict]) -> list[UpdateOne]:
+        """Creates the updates flipping the live statuses of the subscriptions in the collection."""
+
+        return [
+            UpdateOne(
+                {'user_id': subscription['user_id'], 'twitch_user': subscription['twitch_user']},
+                {'$set': {'is_live': not subscription['is_live']}}
+            )
+            for subscription in subscriptions
+        ]
+
+    @staticmethod
+    def flip(subscriptions: list[dict]):
+        """Flips the live statuses of the subscriptions, once they have been written."""
+
+        for subscription in subscriptions:
+            subscription['is_live'] = not subscription['is_live']
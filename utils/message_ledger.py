@@ -0,0 +1,175 @@
+import mmap
+import os
+from array import array
+from datetime import timedelta
+from struct import Struct
+from typing import NamedTuple
+
+import discord
+
+__all__ = ('LedgerEntry', 'MessageLedger')
+
+# message_id, author_id, words, files
+RECORD = Struct('<QQIH2x')
+# capacity, head
+HEADER = Struct('<QQ')
+MESSAGE_ID = Struct('<Q')
+
+EMPTY = -1
+
+
+class LedgerEntry(NamedTuple):
+    author_id: int
+    words: int
+    files: int
+
+
+class MessageLedger:
+    """A compact record of the messages' stats, so that deletes and edits can be counted without the message cache.
+
+    The records have a fixed width and are kept in a ring buffer, so the oldest records are overwritten once the
+    ledger is full. The buffer can be a memory-mapped file, so the ledger survives restarts.
+    Messages are looked up through an open addressing hash index of the record slots.
+    """
+
+    def __init__(self, capacity: int, max_age: timedelta = None, path: str = None):
+        self.capacity = capacity
+        self.max_age = max_age
+
+        size = HEADER.size + capacity * RECORD.size
+        self._file = None
+        if path is not None:
+            open(path, 'ab').close()
+            self._file = open(path, 'r+b')
+            if os.path.getsize(path) != size:
+                self._file.truncate(size)
+            self._buffer = mmap.mmap(self._file.fileno(), size)
+        else:
+            self._buffer = bytearray(size)
+
+        stored_capacity, self._head = HEADER.unpack_from(self._buffer, 0)
+        if stored_capacity != capacity:
+            self._buffer[:] = bytes(size)
+            self._head = 0
+            HEADER.pack_into(self._buffer, 0, capacity, self._head)
+
+        # Kept at most half full, so that the probe sequences stay short
+        self._index = array('i', [EMPTY]) * (capacity * 2)
+        for slot in range(capacity):
+            message_id = self._message_id(slot)
+            if message_id:
+                self._index[self._find(message_id)] = slot
+
+    @staticmethod
+    def _offset(slot: int) -> int:
+        return HEADER.size + slot * RECORD.size
+
+    def _message_id(self, slot: int) -> int:
+        return MESSAGE_ID.unpack_from(self._buffer, self._offset(slot))[0]
+
+    def _home(self, message_id: int) -> int:
+        return message_id % len(self._index)
+
+    def _find(self, message_id: int) -> int:
+        """Returns the index position of the message, or the empty position where it would be inserted."""
+
+        position = self._home(message_id)
+        while True:
+            slot = self._index[position]
+            if slot == EMPTY or self._message_id(slot) == message_id:
+                return position
+
+            position = (position + 1) % len(self._index)
+
+    def _delete(self, position: int):
+        """Removes the entry at the index position, shifting back the entries of its probe sequence."""
+
+        size = len(self._index)
+        self._index[position] = EMPTY
+
+        current = (position + 1) % size
+        while self._index[current] != EMPTY:
+            slot = self._index[current]
+            home = self._home(self._message_id(slot))
+
+            # The entry can fill the hole unless its home lies cyclically in (hole, current]
+            if position <= current:
+                reachable = position < home <= current
+            else:
+                reachable = home > position or home <= current
+
+            if not reachable:
+                self._index[position] = slot
+                self._index[current] = EMPTY
+                position = current
+
+            current = (current + 1) % size
+
+    def _is_expired(self, message_id: int) -> bool:
+        if self.max_age is None:
+            return False
+
+        return discord.utils.snowflake_time(message_id) < discord.utils.utcnow() - self.max_age
+
+    def add(self, message_id: int, author_id: int, words: int, files: int):
+        """Records the message, overwriting the oldest record if the ledger is full."""
+
+        position = self._find(message_id)
+        if self._index[position] != EMPTY:
+            RECORD.pack_into(self._buffer, self._offset(self._index[position]), message_id, author_id, words, files)
+            return
+
+        slot = self._head
+        evicted_id = self._message_id(slot)
+        if evicted_id:
+            self._delete(self._find(evicted_id))
+            position = self._find(message_id)
+
+        RECORD.pack_into(self._buffer, self._offset(slot), message_id, author_id, words, files)
+        self._index[position] = slot
+
+        self._head = (slot + 1) % self.capacity
+        HEADER.pack_into(self._buffer, 0, self.capacity, self._head)
+
+    def get(self, message_id: int) -> LedgerEntry | None:
+        """Gets the message's record, if it is in the ledger and isn't older than max_age."""
+
+        slot = self._index[self._find(message_id)]
+        if slot == EMPTY or self._is_expired(message_id):
+            return None
+
+        _, author_id, words, files = RECORD.unpack_from(self._buffer, self._offset(slot))
+        return LedgerEntry(author_id, words, files)
+
+    def set_words(self, message_id: int, words: int):
+        """Updates the words of the message's record."""
+
+        slot = self._index[self._find(message_id)]
+        if slot == EMPTY:
+            return
+
+        _, author_id, _, files = RECORD.unpack_from(self._buffer, self._offset(slot))
+        RECORD.pack_into(self._buffer, self._offset(slot), message_id, author_id, words, files)
+
+    def pop(self, message_id: int) -> LedgerEntry | None:
+        """Removes the message's record and returns it."""
+
+        entry = self.get(message_id)
+
+        position = self._find(message_id)
+        slot = self._index[position]
+        if slot != EMPTY:
+            RECORD.pack_into(self._buffer, self._offset(slot), 0, 0, 0, 0)
+            self._delete(position)
+
+        return entry
+
+    def close(self):
+        """Flushes and closes the memory-mapped file."""
+
+        if self._file is None:
+            return
+
+        self._buffer.flush()
+        self._buffer.close()
+        self._file.close()
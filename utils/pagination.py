@@ -0,0 +1,174 @@
+from abc import ABC, abstractmethod
+from asyncio import create_task, Task
+from collections import OrderedDict
+from logging import getLogger
+from typing import Any, Awaitable, Callable
+
+from motor.core import AgnosticCollection
+from pymongo import ASCENDING
+
+log = getLogger(__name__)
+
+__all__ = ('PageSource', 'CursorPageSource', 'AggregationPageSource', 'CallbackPageSource', 'TokenPageSource')
+
+# Fetches the page starting at the continuation token, returns its entries and the token of the next page
+TokenPageFetch = Callable[[str | None], Awaitable[tuple[list[Any], str | None]]]
+
+
+class PageSource(ABC):
+    """Fetches the entries of a paginated result one page at a time, keeping the last few pages in an LRU cache."""
+
+    def __init__(self, per_page: int, cache_size: int = 3):
+        self.per_page = per_page
+        self.cache_size = cache_size
+
+        self._total: int | None = None
+        self._pages: OrderedDict[int, list[Any]] = OrderedDict()
+
+    @abstractmethod
+    async def fetch_total(self) -> int:
+        """Fetches the total amount of entries."""
+
+    @abstractmethod
+    async def fetch_page(self, page: int) -> list[Any]:
+        """Fetches the entries of the page."""
+
+    async def total(self) -> int:
+        """Returns the total amount of entries, only fetching it once."""
+
+        if self._total is None:
+            self._total = await self.fetch_total()
+
+        return self._total
+
+    async def get_page(self, page: int) -> list[Any]:
+        """Returns the entries of the page, from the cache if it has been fetched recently."""
+
+        if page in self._pages:
+            self._pages.move_to_end(page)
+            return self._pages[page]
+
+        entries = await self.fetch_page(page)
+
+        self._pages[page] = entries
+        if len(self._pages) > self.cache_size:
+            self._pages.popitem(last=False)
+
+        return entries
+
+
+class CursorPageSource(PageSource):
+    """Pages through a find() query with skip/limit.
+
+    The sort is completed with _id, so that tied entries keep the same order from one page to another.
+    """
+
+    def __init__(
+        self,
+        collection: AgnosticCollection,
+        query: dict,
+        sort: list[tuple[str, int]],
+        per_page: int,
+        cache_size: int = 3
+    ):
+        super().__init__(per_page, cache_size)
+
+        self.collection = collection
+        self.query = query
+        self.sort = sort if any(key == '_id' for key, _ in sort) else [*sort, ('_id', ASCENDING)]
+
+    async def fetch_total(self) -> int:
+        return await self.collection.count_documents(self.query)
+
+    async def fetch_page(self, page: int) -> list[Any]:
+        cursor = self.collection.find(self.query).sort(self.sort).skip(page * self.per_page).limit(self.per_page)
+        return await cursor.to_list(length=self.per_page)
+
+
+class AggregationPageSource(PageSource):
+    """Pages through the result of an aggregation pipeline with $skip/$limit."""
+
+    def __init__(self, collection: AgnosticCollection, pipeline: list[dict], per_page: int, cache_size: int = 3):
+        super().__init__(per_page, cache_size)
+
+        self.collection = collection
+        self.pipeline = pipeline
+
+    async def fetch_total(self) -> int:
+        result = await self.collection.aggregate([*self.pipeline, {'$count': 'total'}]).to_list(length=1)
+        return result[0]['total'] if result else 0
+
+    async def fetch_page(self, page: int) -> list[Any]:
+        cursor = self.collection.aggregate([
+            *self.pipeline,
+            {'$skip': page * self.per_page},
+            {'$limit': self.per_page}
+        ])
+        return await cursor.to_list(length=self.per_page)
+
+
+class CallbackPageSource(PageSource):
+    """Pages through entries computed in memory by a callback returning the first `limit` entries."""
+
+    def __init__(self, total: int, fetch: Callable[[int], list[Any]], per_page: int):
+        super().__init__(per_page, cache_size=0)
+
+        self._total = total
+        self.fetch = fetch
+
+    async def fetch_total(self) -> int:
+        return self._total
+
+    async def fetch_page(self, page: int) -> list[Any]:
+        return self.fetch((page + 1) * self.per_page)[page * self.per_page:]
+
+
+class TokenPageSource(PageSource):
+    """Pages through an API paginated with continuation tokens, so a page can only be reached from the previous one.
+
+    The total isn't known, it grows as the pages are fetched: the page after the last fetched one is counted while
+    the API returns a token for it. Every fetched page prefetches the next one in the background.
+    """
+
+    def __init__(self, fetch: TokenPageFetch, per_page: int, cache_size: int = 3):
+        super().__init__(per_page, cache_size)
+
+        self.fetch = fetch
+        # The continuation token of every page that can be reached
+        self._tokens: list[str | None] = [None]
+        self._prefetch: Task | None = None
+
+    async def total(self) -> int:
+        return await self.fetch_total()
+
+    async def fetch_total(self) -> int:
+        return len(self._tokens) * self.per_page
+
+    async def fetch_page(self, page: int) -> list[Any]:
+        # The page may have been removed by the prefetch since it was counted
+        if page >= len(self._tokens):
+            return []
+
+        entries, next_token = await self.fetch(self._tokens[page])
+        if next_token and entries and page == len(self._tokens) - 1:
+            self._tokens.append(next_token)
+            # Drops the page cached while it was out of range
+            self._pages.pop(page + 1, None)
+
+            self._prefetch = create_task(self.prefetch(page + 1))
+
+        return entries
+
+    async def prefetch(self, page: int):
+        """Fetches the page in the background, the fetch function is expected to cache it.
+
+        APIs may return a token for an empty last page, which is then removed from the pages.
+        """
+
+        try:
+            entries, _ = await self.fetch(self._tokens[page])
+        except Exception as e:
+            return log.warning(f'Failed to prefetch page {page}: {e}')
+
+        if not entries and page == len(self._tokens) - 1:
+            self._tokens.pop()
@@ -0,0 +1,233 @@
+import heapq
+from collections import deque
+from datetime import datetime, timezone
+from math import log2
+from statistics import median
+from time import monotonic
+from typing import Iterable, Mapping, NamedTuple
+
+__all__ = ('HOURS_PER_WEEK', 'hour_of_week', 'StreamerSchedule', 'PollReport', 'PollScheduler')
+
+HOURS_PER_WEEK = 7 * 24
+# The streamers are polled at most this fraction of their interval early, to top up a request's batch
+TOP_UP_FRACTION = 0.25
+
+
+def hour_of_week(date: datetime) -> int:
+    """Returns the hour of the week of the date in UTC, from 0 on Monday 00:00 to 167 on Sunday 23:00."""
+
+    date = date.astimezone(timezone.utc)
+    return date.weekday() * 24 + date.hour
+
+
+class StreamerSchedule:
+    """The polling state of a streamer: its live history and when it is polled next."""
+
+    def __init__(self, twitch_user: str, is_live: bool):
+        self.twitch_user = twitch_user
+        self.is_live = is_live
+        self.subscribers = 1
+        self.next_poll = 0.0
+        self.interval = 0.0
+        # Whether the live status has been polled since startup, the latency can't be measured before that
+        self.observed = False
+
+        self.starts = [0] * HOURS_PER_WEEK
+        self.latencies: deque[float] = deque(maxlen=20)
+
+    def start_likelihood(self, hour: int) -> float:
+        """How likely the streamer is to go live around the hour, relative to their usual start times, from 0 to 1.
+
+        The start counts are smoothed over the previous, current and next hour.
+        """
+
+        def around(h: int) -> int:
+            return self.starts[h - 1] + self.starts[h] + self.starts[(h + 1) % HOURS_PER_WEEK]
+
+        peak = max(around(h) for h in range(HOURS_PER_WEEK))
+        return around(hour) / peak if peak else 0
+
+
+class PollReport(NamedTuple):
+    twitch_user: str
+    subscribers: int
+    interval: float
+    latency: float | None
+    samples: int
+
+
+class PollScheduler:
+    """Decides which streamers to poll, each at its own interval, within a global request budget.
+
+    Streamers are polled more often around the hours they usually go live and when they have more subscribers, and
+    less often otherwise. Streamers without a history are polled every default_interval. The streamers are kept in a
+    priority queue by their next poll time, and the requests are paid from a token bucket refilled at
+    requests_per_minute.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 30,
+        min_interval: float = 20,
+        default_interval: float = 60,
+        max_interval: float = 600,
+        live_interval: float = 120
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.min_interval = min_interval
+        self.default_interval = default_interval
+        self.max_interval = max_interval
+        self.live_interval = live_interval
+        # The intervals are multiplied by it, e.g. while the notifications are pushed by EventSub
+        self.slowdown = 1
+
+        self.schedules: dict[str, StreamerSchedule] = {}
+        self._history: dict[str, Mapping[int, int]] = {}
+        self._queue: list[tuple[float, str]] = []
+        self._tokens = 1.0
+        self._refilled_at = monotonic()
+
+    def sync(self, streamers: Mapping[str, tuple[int, bool]]):
+        """Adds the new streamers, due right away, and removes the unfollowed ones.
+
+        The streamers are mapped to their amount of subscribers and their live status.
+        """
+
+        for twitch_user in self.schedules.keys() - streamers.keys():
+            del self.schedules[twitch_user]
+
+        for twitch_user, (subscribers, is_live) in streamers.items():
+            schedule = self.schedules.get(twitch_user)
+            if schedule is None:
+                schedule = self.schedules[twitch_user] = StreamerSchedule(twitch_user, is_live)
+                for hour, count in self._history.pop(twitch_user, {}).items():
+                    schedule.starts[hour] = count
+
+                heapq.heappush(self._queue, (schedule.next_poll, twitch_user))
+
+            schedule.subscribers = subscribers
+
+    def load_history(self, twitch_user: str, starts: Mapping[int, int]):
+        """Sets the amount of times the streamer went live in each hour of the week, used once it is synced."""
+
+        self._history[twitch_user] = starts
+
+    def interval(self, schedule: StreamerSchedule) -> float:
+        """Computes how long to wait before polling the streamer again."""
+
+        if schedule.is_live:
+            interval = self.live_interval
+        elif not any(schedule.starts):
+            interval = self.default_interval
+        else:
+            likelihood = schedule.start_likelihood(hour_of_week(datetime.now(timezone.utc)))
+            interval = self.max_interval - (self.max_interval - self.min_interval) * likelihood
+
+        interval /= 1 + log2(max(schedule.subscribers, 1)) / 4
+        return max(interval, self.min_interval) * self.slowdown
+
+    def _refill(self):
+        now = monotonic()
+        capacity = max(self.requests_per_minute / 6, 1)
+        self._tokens = min(self._tokens + (now - self._refilled_at) * self.requests_per_minute / 60, capacity)
+        self._refilled_at = now
+
+    def _pop(self) -> StreamerSchedule | None:
+        """Pops the streamer with the earliest poll time, skipping the queue entries that are outdated."""
+
+        while self._queue:
+            next_poll, twitch_user = heapq.heappop(self._queue)
+            schedule = self.schedules.get(twitch_user)
+            if schedule is not None and schedule.next_poll == next_poll:
+                return schedule
+
+        return None
+
+    def due(self, batch_size: int) -> list[str]:
+        """Returns the streamers to poll now, in batches of batch_size per request, as many as the budget allows.
+
+        Batches that aren't full are topped up with the streamers due within TOP_UP_FRACTION of their interval, since
+        they don't cost a request more. The streamers that didn't fit in the budget stay due.
+        The returned streamers are out of the queue until they are recorded or postponed.
+        """
+
+        self._refill()
+
+        now = monotonic()
+        streamers = []
+        while self._tokens >= 1 and self._queue and self._queue[0][0] <= now:
+            self._tokens -= 1
+
+            for _ in range(batch_size):
+                schedule = self._pop()
+                if schedule is None:
+                    break
+
+                if schedule.next_poll > now + schedule.interval * TOP_UP_FRACTION:
+                    heapq.heappush(self._queue, (schedule.next_poll, schedule.twitch_user))
+                    break
+
+                # Rescheduled in record(), this just keeps it out of the queue until then
+                schedule.next_poll = float('inf')
+                streamers.append(schedule.twitch_user)
+
+        return streamers
+
+    def record(self, streamers: Iterable[str], live_streams: Mapping[str, dict]) -> list[tuple[str, int]]:
+        """Records the polled live statuses and reschedules the streamers.
+
+        Returns the (streamer, hour of the week) of the streams that started, so the history can be stored.
+        """
+
+        starts = []
+        now = datetime.now(timezone.utc)
+        for twitch_user in streamers:
+            schedule = self.schedules.get(twitch_user)
+            if schedule is None:
+                continue
+
+            stream = live_streams.get(twitch_user)
+            if stream is not None and not schedule.is_live:
+                started_at = datetime.strptime(stream['started_at'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+                if schedule.observed:
+                    schedule.latencies.append((now - started_at).total_seconds())
+
+                hour = hour_of_week(started_at)
+                schedule.starts[hour] += 1
+                starts.append((twitch_user, hour))
+
+            schedule.is_live = stream is not None
+            schedule.observed = True
+            self.reschedule(schedule)
+
+        return starts
+
+    def reschedule(self, schedule: StreamerSchedule):
+        schedule.interval = self.interval(schedule)
+        schedule.next_poll = monotonic() + schedule.interval
+        heapq.heappush(self._queue, (schedule.next_poll, schedule.twitch_user))
+
+    def postpone(self, streamers: Iterable[str]):
+        """Reschedules the streamers whose poll wasn't recorded, e.g. because it failed, without recording anything.
+
+        The streamers that have already been rescheduled are left as they are.
+        """
+
+        for twitch_user in streamers:
+            schedule = self.schedules.get(twitch_user)
+            if schedule is not None and schedule.next_poll == float('inf'):
+                self.reschedule(schedule)
+
+    def report(self) -> list[PollReport]:
+        """Returns the polling interval and the median notification latency of every streamer."""
+
+        return [
+            PollReport(
+                schedule.twitch_user,
+                schedule.subscribers,
+                schedule.interval,
+                median(schedule.latencies) if schedule.latencies else None,
+                len(schedule.latencies)
+            )
+            for schedule in self.schedules.values()
+        ]
@@ -0,0 +1,52 @@
+from asyncio import Lock
+from collections import Counter, defaultdict
+from logging import getLogger
+from typing import Awaitable, Callable, Hashable
+
+log = getLogger(__name__)
+
+__all__ = ('StatsBuffer',)
+
+FlushCallback = Callable[[dict[Hashable, Counter]], Awaitable[None]]
+
+
+class StatsBuffer:
+    """Sums counter deltas in memory so that they can be written to the database in batches."""
+
+    def __init__(self, flush_callback: FlushCallback, max_size: int = 1000):
+        self.flush_callback = flush_callback
+        self.max_size = max_size
+
+        self._data: dict[Hashable, Counter] = defaultdict(Counter)
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    async def add(self, key: Hashable, **deltas: int):
+        """Adds the deltas to the entry with the given key. Flushes the buffer if it is full."""
+
+        self._data[key].update(deltas)
+
+        if len(self._data) >= self.max_size:
+            await self.flush()
+
+    async def flush(self):
+        """Passes the buffered deltas to the flush callback and empties the buffer.
+
+        If the callback fails, the deltas are put back so that they are retried on the next flush.
+        """
+
+        async with self.lock:
+            if not self._data:
+                return
+
+            data, self._data = self._data, defaultdict(Counter)
+
+            try:
+                await self.flush_callback(data)
+            except Exception:
+                for key, deltas in data.items():
+                    self._data[key].update(deltas)
+
+                raise
@@ -0,0 +1,243 @@
+from collections import defaultdict
+from logging import getLogger
+from typing import Mapping
+
+from motor.core import AgnosticCollection
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = getLogger(__name__)
+
+__all__ = ('GuildReplica', 'StatsReplica')
+
+STATS = ('messages', 'words', 'reactions', 'files')
+
+
+def top(ids: list[int], values: 'np.ndarray', limit: int) -> list[tuple[int, int]]:
+    """Returns the (id, value) pairs with the highest values, sorted in descending order."""
+
+    limit = min(limit, len(values))
+    if limit <= 0:
+        return []
+
+    if limit < len(values):
+        indices = np.argpartition(-values, limit - 1)[:limit]
+    else:
+        indices = np.arange(len(values))
+
+    indices = indices[np.argsort(-values[indices], kind='stable')]
+    return [(ids[i], int(values[i])) for i in indices]
+
+
+class GuildReplica:
+    """An in-memory copy of a guild's stats.
+
+    Every (channel, user) pair of the guild is a row, the users and channels are mapped to dense integer indices and
+    each stat is a column array. The totals and leaderboards are computed with vectorized sums over the rows.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.size = 0
+        self.user_ids: list[int] = []
+        self.channel_ids: list[int] = []
+
+        self._user_index: dict[int, int] = {}
+        self._channel_index: dict[int, int] = {}
+        self._rows: dict[tuple[int, int], int] = {}
+
+        self._row_users = np.zeros(capacity, np.int32)
+        self._row_channels = np.zeros(capacity, np.int32)
+        self._counts = {stat: np.zeros(capacity, np.int64) for stat in STATS}
+
+    def _row(self, channel_id: int, user_id: int) -> int:
+        """Returns the row of the (channel, user) pair, creating it if it doesn't exist yet."""
+
+        row = self._rows.get((channel_id, user_id))
+        if row is not None:
+            return row
+
+        if channel_id not in self._channel_index:
+            self._channel_index[channel_id] = len(self.channel_ids)
+            self.channel_ids.append(channel_id)
+
+        if user_id not in self._user_index:
+            self._user_index[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+
+        if self.size == len(self._row_users):
+            self._grow()
+
+        row = self._rows[channel_id, user_id] = self.size
+        self._row_channels[row] = self._channel_index[channel_id]
+        self._row_users[row] = self._user_index[user_id]
+        self.size += 1
+
+        return row
+
+    def _grow(self):
+        capacity = len(self._row_users) * 2
+
+        def grown(array: 'np.ndarray') -> 'np.ndarray':
+            new_array = np.zeros(capacity, array.dtype)
+            new_array[:len(array)] = array
+            return new_array
+
+        self._row_users = grown(self._row_users)
+        self._row_channels = grown(self._row_channels)
+        self._counts = {stat: grown(counts) for stat, counts in self._counts.items()}
+
+    def add(self, channel_id: int, user_id: int, deltas: Mapping[str, int]):
+        """Increments the stats of the (channel, user) pair by the deltas."""
+
+        row = self._row(channel_id, user_id)
+        for stat in STATS:
+            self._counts[stat][row] += deltas.get(stat, 0)
+
+    def _sums(self, stat: str, by: 'np.ndarray', length: int) -> 'np.ndarray':
+        """Sums the stat of the rows grouped by the given row indices.
+
+        The sums are floats, which are exact up to 2^53, so that excluded entries can be set to -inf.
+        """
+
+        return np.bincount(by[:self.size], weights=self._counts[stat][:self.size], minlength=length)
+
+    def _user_sums(self, stat: str) -> 'np.ndarray':
+        return self._sums(stat, self._row_users, len(self.user_ids))
+
+    def _channel_sums(self, stat: str) -> 'np.ndarray':
+        return self._sums(stat, self._row_channels, len(self.channel_ids))
+
+    def user_totals(self, user_id: int) -> dict[str, int] | None:
+        """Returns the user's total stats."""
+
+        index = self._user_index.get(user_id)
+        if index is None:
+            return None
+
+        rows = self._row_users[:self.size] == index
+        return {stat: int(self._counts[stat][:self.size][rows].sum()) for stat in STATS}
+
+    def channel_totals(self, channel_id: int) -> dict[str, int] | None:
+        """Returns the channel's total stats."""
+
+        index = self._channel_index.get(channel_id)
+        if index is None:
+            return None
+
+        rows = self._row_channels[:self.size] == index
+        return {stat: int(self._counts[stat][:self.size][rows].sum()) for stat in STATS}
+
+    def users_leaderboard(self, stat: str, limit: int, excluded_user_id: int = None) -> list[dict]:
+        """Returns the top users for the stat."""
+
+        sums = self._user_sums(stat)
+        if excluded_user_id in self._user_index:
+            sums[self._user_index[excluded_user_id]] = -np.inf
+            limit = min(limit, len(sums) - 1)
+
+        return [{'user_id': user_id, stat: value} for user_id, value in top(self.user_ids, sums, limit)]
+
+    def channels_leaderboard(self, stat: str, limit: int) -> list[dict]:
+        """Returns the top channels for the stat."""
+
+        sums = self._channel_sums(stat)
+        return [{'channel_id': channel_id, stat: value} for channel_id, value in top(self.channel_ids, sums, limit)]
+
+    def user_channels(self, user_id: int, stat: str, limit: int) -> list[dict]:
+        """Returns the user's top channels for the stat."""
+
+        index = self._user_index.get(user_id)
+        if index is None:
+            return []
+
+        rows = np.flatnonzero(self._row_users[:self.size] == index)
+        channel_ids = [self.channel_ids[i] for i in self._row_channels[rows]]
+        return [
+            {'channel_id': channel_id, stat: value}
+            for channel_id, value in top(channel_ids, self._counts[stat][rows], limit)
+        ]
+
+    def channel_users(self, channel_id: int, stat: str, limit: int, excluded_user_id: int = None) -> list[dict]:
+        """Returns the channel's top users for the stat."""
+
+        index = self._channel_index.get(channel_id)
+        if index is None:
+            return []
+
+        rows = self._row_channels[:self.size] == index
+        if excluded_user_id in self._user_index:
+            rows &= self._row_users[:self.size] != self._user_index[excluded_user_id]
+
+        rows = np.flatnonzero(rows)
+        user_ids = [self.user_ids[i] for i in self._row_users[rows]]
+        return [
+            {'user_id': user_id, stat: value}
+            for user_id, value in top(user_ids, self._counts[stat][rows], limit)
+        ]
+
+    def user_rank(self, user_id: int, stat: str, excluded_user_id: int = None) -> int | None:
+        """Returns the user's position in the users leaderboard of the stat."""
+
+        index = self._user_index.get(user_id)
+        if index is None:
+            return None
+
+        sums = self._user_sums(stat)
+        if excluded_user_id in self._user_index:
+            sums[self._user_index[excluded_user_id]] = -np.inf
+
+        return int((sums > sums[index]).sum()) + 1
+
+    def count_users(self, excluded_user_id: int = None) -> int:
+        return len(self.user_ids) - (excluded_user_id in self._user_index)
+
+    def count_channels(self) -> int:
+        return len(self.channel_ids)
+
+    def count_user_channels(self, user_id: int) -> int:
+        index = self._user_index.get(user_id)
+        return int((self._row_users[:self.size] == index).sum()) if index is not None else 0
+
+    def count_channel_users(self, channel_id: int, excluded_user_id: int = None) -> int:
+        index = self._channel_index.get(channel_id)
+        if index is None:
+            return 0
+
+        rows = self._row_channels[:self.size] == index
+        if excluded_user_id in self._user_index:
+            rows &= self._row_users[:self.size] != self._user_index[excluded_user_id]
+
+        return int(rows.sum())
+
+
+class StatsReplica:
+    """An in-memory copy of every guild's stats, warmed from the database and kept current with the written deltas."""
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError('The stats replica requires NumPy to be installed')
+
+        self.guilds: dict[int, GuildReplica] = defaultdict(GuildReplica)
+
+    def get(self, guild_id: int) -> GuildReplica:
+        return self.guilds[guild_id]
+
+    def apply(self, totals: Mapping[tuple[int, int, int], Mapping[str, int]]):
+        """Applies the deltas keyed by (guild_id, channel_id, user_id)."""
+
+        for (guild_id, channel_id, user_id), deltas in totals.items():
+            self.guilds[guild_id].add(channel_id, user_id, deltas)
+
+    async def warm(self, stats: AgnosticCollection):
+        """Loads all the stats from the database."""
+
+        self.guilds.clear()
+
+        cursor = stats.find({}, {'_id': 0, 'guild_id': 1, 'channel_id': 1, 'user_id': 1, **{s: 1 for s in STATS}})
+        async for entry in cursor:
+            self.guilds[entry['guild_id']].add(entry['channel_id'], entry['user_id'], entry)
+
+        log.info(f'Warmed the stats replica with {sum(g.size for g in self.guilds.values()):,} entries')
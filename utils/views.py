@@ -7,6 +7,7 @@ from discord import ButtonStyle, Interaction, Message, HTTPException, Forbidden
 from discord.ui import View, Button, button, Modal, TextInput, Select, select
 
 from utils.embeds import error_embed, green_embed, Embed
+from utils.pagination import PageSource
 
 if TYPE_CHECKING:
     from nextbot import NextBot
@@ -182,8 +183,7 @@ class PaginationView(View):
     def __init__(
         self,
         title: str,
-        data: list[Any],
-        per_page: int,
+        source: PageSource,
         entry_generator: Callable[[Any], Generator[str, None, None]],
         interaction: Interaction = None,
         description: str = None,
@@ -193,15 +193,13 @@ class PaginationView(View):
 
         self.title = title
         self.description = description
-        self.data = data
-        self.per_page = per_page
-        self.pages = math.ceil(len(data) / per_page) or 1
+        self.source = source
+        self.pages = 1
         self.generator = entry_generator
         self.interaction = interaction
         self.thumbnail_url = thumbnail_url
 
         self.current_page = 0
-        self.update_buttons()
 
     async def on_timeout(self) -> None:
         """Disables the buttons."""
@@ -228,14 +226,22 @@ class PaginationView(View):
         self.previous.disabled = self.current_page == 0
         self.next.disabled = self.current_page == self.pages - 1
 
-    def embed(self) -> discord.Embed:
-        """Creates an embed for the current page."""
+    async def embed(self) -> discord.Embed:
+        """Fetches the current page and creates an embed for it."""
+
+        per_page = self.source.per_page
+        data = await self.source.get_page(self.current_page)
+
+        self.pages = math.ceil(await self.source.total() / per_page) or 1
+        if self.current_page >= self.pages:  # The source shrank, e.g. a page turned out to be empty
+            self.current_page = self.pages - 1
+            data = await self.source.get_page(self.current_page)
 
-        data = self.data[self.current_page * self.per_page : (self.current_page + 1) * self.per_page]
+        self.update_buttons()
         embed = Embed(
             title=self.title,
             description=(self.description or '') + '\n'.join(
-                f'{i + self.current_page * self.per_page}. {entry}'
+                f'{i + self.current_page * per_page}. {entry}'
                 for i, entry in enumerate(self.generator(data), 1)
             )
         )
@@ -244,6 +250,21 @@ class PaginationView(View):
 
         return embed
 
+    async def turn_page(self, interaction: Interaction, page: int):
+        """Shows the page, or keeps the current one if fetching it fails, e.g. on an API error."""
+
+        previous_page = self.current_page
+        self.current_page = page
+        try:
+            embed = await self.embed()
+        except Exception as e:
+            log.error(f'Failed to fetch page {page} of {self.title}: {e}')
+            self.current_page = previous_page
+            self.update_buttons()
+            return await error_embed(interaction, 'Couldn\'t fetch the page, try again later!', ephemeral=True)
+
+        await interaction.response.edit_message(embed=embed, view=self)
+
     @discord.ui.button(style=discord.ButtonStyle.grey, emoji='⬅', custom_id='previous_page')
     async def previous(self, interaction: Interaction, btn: discord.ui.Button):
         """Goes to the previous page."""
@@ -251,10 +272,7 @@ class PaginationView(View):
         if self.interaction is not None and interaction.user.id != self.interaction.user.id:
             return await error_embed(interaction, 'You are not allowed to do this!')
 
-        self.current_page -= 1
-        self.update_buttons()
-
-        await interaction.response.edit_message(embed=self.embed(), view=self)
+        await self.turn_page(interaction, self.current_page - 1)
 
     @discord.ui.button(style=discord.ButtonStyle.grey, disabled=True)
     async def current_info(self, interaction: Interaction, btn: discord.ui.Button):
@@ -269,7 +287,4 @@ class PaginationView(View):
         if self.interaction is not None and interaction.user.id != self.interaction.user.id:
             return await error_embed(interaction, 'You are not allowed to do this!')
 
-        self.current_page += 1
-        self.update_buttons()
-
-        await interaction.response.edit_message(embed=self.embed(), view=self)
+        await self.turn_page(interaction, self.current_page + 1)